@@ -3,5 +3,7 @@
 pip install numpy
 pip install cython
 pip install numexpr
+# concurrent.futures backport for lazy.executor
+python -c "import sys; sys.exit(sys.version_info[0] > 2)" && pip install futures
 pip install git+https://github.com/dalejung/pandas.git@pandas_metaclass#egg=pandas
 pip install .
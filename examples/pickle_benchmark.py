@@ -0,0 +1,55 @@
+"""
+Pickling a UserFrame with the version 1 state, protocol 2, against the
+version 2 state with protocol 5 out-of-band buffers.
+
+    python examples/pickle_benchmark.py
+"""
+import pickle
+import timeit
+
+import numpy as np
+
+from pandas_composition import UserFrame, UserSeries
+
+def frames(nrows):
+    uf = UserFrame(np.random.randn(nrows, 20))
+    uf.name = 'floats'
+    yield uf
+
+    mixed = UserFrame(np.random.randn(nrows, 18))
+    s = UserSeries(np.arange(nrows))
+    s.units = 'shares'
+    mixed['volume'] = s
+    mixed['symbol'] = 'AAPL'
+    mixed.name = 'mixed'
+    yield mixed
+
+def v1(uf):
+    data = pickle.dumps(uf, protocol=2)
+    return data, lambda: pickle.loads(data)
+
+def v2(uf):
+    buffers = []
+    data = pickle.dumps(uf, protocol=5, buffer_callback=buffers.append)
+    return data, lambda: pickle.loads(data, buffers=buffers)
+
+def best(func, number=10, repeat=3):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+def bench(uf):
+    res = {}
+    for name, dump in [('v1 protocol 2', v1), ('v2 protocol 5', v2)]:
+        data, load = dump(uf)
+        res[name] = (best(lambda: dump(uf)), best(load), len(data))
+    return res
+
+if __name__ == '__main__':
+    if pickle.HIGHEST_PROTOCOL < 5:
+        raise SystemExit("protocol 5 needs python 3.8+")
+    print('{0:<8} {1:>9} {2:<14} {3:>10} {4:>10} {5:>12}'.format(
+        'frame', 'rows', 'format', 'dump ms', 'load ms', 'in-band'))
+    for nrows in [10 ** 3, 10 ** 5, 10 ** 6]:
+        for uf in frames(nrows):
+            for name, (dump, load, nbytes) in sorted(bench(uf).items()):
+                print('{0:<8} {1:>9} {2:<14} {3:>10.3f} {4:>10.3f} {5:>12}'.format(
+                    uf.name, nrows, name, dump * 1000, load * 1000, nbytes))
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+
 import pandas as pd
 import numpy as np
 import inspect
@@ -5,6 +7,15 @@ import inspect
 from pandas_composition.series import UserSeries
 from pandas_composition.frame import UserFrame, _get_meta
 from pandas_composition.metaclass import PandasSuperMeta, PandasMeta
+from pandas_composition.base import (META_PROPAGATE, META_DROP,
+                                     maybe_install_ipython_completers)
+from pandas_composition.compute import (ENGINE_PANDAS, ENGINE_NUMEXPR,
+                                        ENGINE_AUTO, set_engine, calibrate)
+
+# originals, so the patches can be removed and so where() doesn't
+# recurse into itself
+_np_where = np.where
+_series_view = pd.Series.view
 
 # monkey patch
 def view(self, dtype):
@@ -13,18 +24,52 @@ def view(self, dtype):
 
     return self._constructor(self.values.view(dtype), index=self.index, name=self.name)
 
-pd.Series.view = view
-
 def where(condition, *args):
-    if len(args) > 0:
-        res = np.core.multiarray.where(condition, *args)
-    else: 
-        res = np.core.multiarray.where(condition)
+    res = _np_where(condition, *args)
+    if len(args) == 0:
+        return res
 
     if isinstance(condition, UserSeries):
         series = pd.Series(res, index=condition.index, name=condition.name)
-        wrapped = condition.copy()
-        wrapped.pobj = series
-        return wrapped
+        # box without copying the condition's data
+        return condition._box(series)
+    if isinstance(condition, UserFrame):
+        frame = pd.DataFrame(res, index=condition.index, columns=condition.columns)
+        return condition._box(frame)
     return res
-np.where = where
+
+def install_patches():
+    """
+    Replace np.where and pd.Series.view process-wide so they are aware
+    of UserSeries/UserFrame. Not done on import since every np.where call
+    would pay for it.
+    """
+    pd.Series.view = view
+    np.where = where
+
+def uninstall_patches():
+    """ Restore the original np.where and pd.Series.view """
+    pd.Series.view = _series_view
+    np.where = _np_where
+
+@contextmanager
+def patched():
+    """
+    Context manager version of install_patches. Restores whatever was
+    installed before on exit.
+
+    >>> with patched():
+    ...     wh = np.where(us > 5, 1, 0)
+    """
+    old_view = pd.Series.view
+    old_where = np.where
+    install_patches()
+    try:
+        yield
+    finally:
+        pd.Series.view = old_view
+        np.where = old_where
+
+def load_ipython_extension(ipython):
+    """ %load_ext pandas_composition """
+    maybe_install_ipython_completers(force=True)
@@ -1,9 +1,19 @@
 from operator import attrgetter
 import types
 import collections
+import sys
 
+import numpy as np
 import pandas as pd
 
+try:
+    from pickle import PickleBuffer
+except ImportError:
+    # python < 3.8. No protocol 5
+    PickleBuffer = None
+
+from pandas_composition import compute
+
 def _is_user_class(obj):
     """ Check whether the obj is a UserFrame/UserSeries """
     type_dict = type(obj).__dict__
@@ -55,6 +65,128 @@ def _wrap_method(_meth_name):
 WRAP_HANDLERS = []
 WRAP_HANDLERS.append((collections.Callable, _wrap_callable))
 
+# IPYTHON
+# Modules register their completer installers here. They are installed the
+# first time a UserFrame/UserSeries is created instead of on import.
+_ipython_completers = []
+_ipython_checked = False
+
+def register_ipython_completers(install):
+    _ipython_completers.append(install)
+
+def maybe_install_ipython_completers(force=False):
+    """
+    Install registered IPython completers once. Importing IPython brings
+    in about 200 modules, so unless forced, only do so if we're already in
+    IPython (when those modules are loaded anyway).
+    """
+    global _ipython_checked
+    if _ipython_checked:
+        return
+    if not force and "IPython" not in sys.modules:
+        return
+    _ipython_checked = True
+    for install in _ipython_completers:
+        try:
+            install()
+        except Exception:
+            pass
+
+# used by UserPandasObject.__getattribute__ to resolve attribute names.
+# See metaclass.build_attr_table
+ATTR_SPECIAL = 'special'
+ATTR_USER = 'user'
+ATTR_PANDAS = 'pandas'
+
+# attributes that go straight to the UserPandasObject instance
+SPECIAL_ATTRS = frozenset(['pget', 'pobj', '_delegate', '_wrap', '_get',
+                           '__class__', '__array_finalize__', 'view',
+                           '__tr_getattr__'])
+
+# mro walk stops at these. Anything after is a pandas attribute.
+PANDAS_BASES = (pd.DataFrame, pd.Series, pd.TimeSeries, pd.Panel)
+
+# metadata propagation policy. See propagate_meta
+META_PROPAGATE = 'propagate'
+META_DROP = 'drop'
+
+def meta_policy(cls, method=None):
+    """
+    Return the metadata policy of cls for results of `method`.
+    `_meta_method_policy` overrides are laid over `_meta_policy`.
+    """
+    policy = getattr(cls, '_meta_policy', None)
+    method_policy = getattr(cls, '_meta_method_policy', None)
+    if method_policy and method in method_policy:
+        policy = dict(policy or {})
+        policy.update(method_policy[method])
+    return policy
+
+def propagate_meta(cls, meta, method=None):
+    """
+    Filter meta through the policy of cls.
+
+    Policy values are:
+        META_PROPAGATE : copy to the result. The default.
+        META_DROP : do not copy to the result.
+        callable : do not copy, recompute on first access as func(result)
+
+    Returns meta itself if nothing was filtered so it can be shared.
+    """
+    policy = meta_policy(cls, method)
+    if not policy:
+        return meta
+
+    lazy = {}
+    for k, rule in policy.items():
+        if k in meta and callable(rule):
+            lazy[k] = method
+    skip = [k for k in meta if k in policy and policy[k] != META_PROPAGATE]
+    if not skip:
+        return meta
+
+    new_meta = dict((k, v) for k, v in meta.items() if k not in skip)
+    if lazy:
+        pending = dict(meta.get('_meta_lazy') or {})
+        pending.update(lazy)
+        new_meta['_meta_lazy'] = pending
+    return new_meta
+
+def attach_pobj(cls, pobj, meta, shared_with=None):
+    """
+    Create a cls instance around an existing pandas object without
+    running the pandas constructor or cls.__init__.
+
+    `meta` becomes the instance __dict__. When `shared_with` is passed,
+    meta must be its __dict__ and both objects will copy it on write.
+    """
+    new = object.__new__(cls)
+    object.__setattr__(new, '__dict__', meta)
+    if shared_with is not None:
+        # share meta until either side writes. See _unshare_meta
+        object.__setattr__(new, '_meta_shared', True)
+        object.__setattr__(shared_with, '_meta_shared', True)
+    object.__setattr__(new, 'pobj', pobj)
+    return new
+
+# pickle protocol 5. See UserFrame.__reduce_ex__
+def can_buffer(dtype):
+    """ Whether data of dtype can be pickled as an out-of-band buffer """
+    return PickleBuffer is not None and dtype.kind in 'biufc'
+
+def to_buffer(arr):
+    """ arr as a PickleBuffer. Only copies when arr isn't contiguous """
+    return PickleBuffer(np.ascontiguousarray(arr))
+
+def from_buffer(buf, dtype, shape):
+    """
+    Array of shape over an unpickled buffer. Nothing is copied, so it is
+    read-only when the buffer is.
+    """
+    if not np.prod(shape):
+        return np.empty(shape, dtype=dtype)
+    return np.frombuffer(buf, dtype=dtype).reshape(shape)
+
 class UserPandasObject(object):
     """
         Base methods of a quasi pandas subclass.
@@ -84,32 +216,41 @@ class UserPandasObject(object):
             We will subclass the DataFrame to trick internal pandas machinery
             into thinking this class quacks like a duck.
         """
+        cls = type(self)
+        kind = cls._attr_table.get(name)
+
         # special attribute that need to go straight to this obj
-        if name in ['pget', 'pobj', '_delegate', '_wrap', '_get',
-                    '__class__', '__array_finalize__', 'view', '__tr_getattr__']:
+        if kind is ATTR_SPECIAL:
             return object.__getattribute__(self, name)
 
-        try:
-            return self.__tr_getattr__(name)
-        except AttributeError:
-            pass
+        # only run __tr_getattr__ when a subclass actually overrides it
+        if cls._has_tr_getattr:
+            try:
+                return self.__tr_getattr__(name)
+            except AttributeError:
+                pass
+
+        # overridden values. Anything defined by pandas-composition classes
+        # before hitting the pandas classes in the mro
+        if kind is ATTR_USER:
+            return object.__getattribute__(self, name)
 
-        # Run through mro and use overridden values.
-        mro = type(self).__mro__
-        for kls in mro:
-            # stop after pandas-composition class and before pandas classes
-            if kls in [pd.DataFrame, pd.Series, pd.TimeSeries, pd.Panel]:
-                break
-            type_dict = kls.__dict__
-            if name in type_dict:
-                return object.__getattribute__(self, name)
+        if kind is ATTR_PANDAS:
+            return self._wrap(name)
 
+        # not known at class creation. i.e. instance attributes on pobj
+        # or pandas attrs monkey patched on later
         if hasattr(self.pobj, name):
+            if hasattr(cls._pandas_type, name):
+                cls._attr_table[name] = ATTR_PANDAS
             return self._wrap(name)
 
         return object.__getattribute__(self, name)
 
     def __setattr__(self, name, value):
+        if name == 'pobj':
+            object.__setattr__(self, name, value)
+            return
         if name in self._get('__dict__'):
             self.set_meta(name, value)
             return
@@ -130,14 +271,48 @@ class UserPandasObject(object):
             # note this is largely a failsafe, we shouldn't get to this
             # point via setattr since it'll match the hasattr(self.pobj, name)
             raise Exception('Cannot have member variables that clash with pandas constructor args')
+        self._unshare_meta()
         object.__setattr__(self, name, value)
 
+    def __delattr__(self, name):
+        self._unshare_meta()
+        object.__delattr__(self, name)
+
+    def _unshare_meta(self):
+        """
+        Metadata is copy-on-write. Boxed results share the __dict__ of
+        the object they came from until either side writes to it.
+        """
+        try:
+            shared = object.__getattribute__(self, '_meta_shared')
+        except AttributeError:
+            return
+        if shared:
+            meta = object.__getattribute__(self, '__dict__')
+            object.__setattr__(self, '__dict__', meta.copy())
+            object.__setattr__(self, '_meta_shared', False)
+
     @property
     def meta(self):
+        # meta is returned for writing, so make sure it is our own
+        self._unshare_meta()
         return self._get('__dict__')
 
     def __getattr__(self, name):
         # unset the inherited logic here.
+        # The only exception is meta that is pending a lazy recompute
+        pending = self._get('__dict__').get('_meta_lazy')
+        if pending and name in pending:
+            policy = meta_policy(type(self), pending[name]) or {}
+            func = policy.get(name)
+            if not callable(func):
+                raise AttributeError(name)
+            value = func(self)
+            rest = dict(pending)
+            del rest[name]
+            self.set_meta('_meta_lazy', rest)
+            self.set_meta(name, value)
+            return value
         raise AttributeError(name)
 
     def __tr_getattr__(self, name):
@@ -206,6 +381,12 @@ class UserPandasObject(object):
             Series/DataFrame, this will autobox the results into the original class.
             This is intended
         """
+        if _attr_name in compute.ops and len(args) == 1 and not kwargs:
+            # large elementwise ops can go through numexpr. see compute
+            res = compute.evaluate_op(self, _attr_name, args[0])
+            if res is not None:
+                return self._box(res, _attr_name)
+
         attr = self.pget(_attr_name)
         res = attr
         if callable(attr):
@@ -214,18 +395,34 @@ class UserPandasObject(object):
         # should just add pandas_types so UserSeries can have two panda types
         if isinstance(res, type(self)._pandas_type) and  \
            type(res) in [pd.DataFrame, pd.Series, pd.TimeSeries]:
-            meta = self._get('__dict__')
-            # pass in meta as kwargs in case init requires them
-            # this assumes that init arg and member name will
-            # always be the same. i.e. self.bob = bob
-            # make sure to not init args the same name as
-            # pandas constructor arguments
-            res = type(self)(res, **meta)
-            # transfer metadata
-            new_dict = res._get('__dict__')
-            for k in meta.keys():
-                # skip df
-                if k == 'pobj':
-                    continue
-                new_dict[k] = meta[k]
+            res = self._box(res, _attr_name)
         return res
+
+    def _box(self, pobj, method=None):
+        """
+        Box a pandas object into type(self) and transfer our metadata.
+
+        By default this attaches pobj directly and skips both the pandas
+        constructor and the subclass __init__. Subclasses that need their
+        __init__ to run on every result can set `_box_init = True`.
+
+        Metadata is filtered by the class `_meta_policy` for `method`.
+        """
+        cls = type(self)
+        own_meta = self._get('__dict__')
+        meta = propagate_meta(cls, own_meta, method)
+        if not cls._box_init:
+            shared_with = self if meta is own_meta else None
+            return attach_pobj(cls, pobj, meta, shared_with)
+
+        # pass in meta as kwargs in case init requires them
+        # this assumes that init arg and member name will
+        # always be the same. i.e. self.bob = bob
+        # make sure to not init args the same name as
+        # pandas constructor arguments
+        new = cls(pobj, **meta)
+        # transfer metadata
+        new_dict = new._get('__dict__')
+        new_dict.update(meta)
+        object.__setattr__(new, 'pobj', pobj)
+        return new
@@ -0,0 +1,229 @@
+"""
+Engine policy for UserFrame/UserSeries arithmetic.
+
+Large elementwise operations can be evaluated with numexpr, through the
+lazy engine, instead of pandas. Classes choose with `_engine` and
+`_engine_threshold`. Unset, they fall back to the global `options`.
+
+    * ENGINE_PANDAS always uses pandas. The default.
+    * ENGINE_NUMEXPR uses numexpr whenever the operation supports it.
+    * ENGINE_AUTO uses numexpr once an operand has threshold elements.
+
+The threshold is the size where numexpr starts beating pandas. calibrate()
+measures it on the current machine. It is only saved when given a path,
+sessions load CALIBRATION_FILE if it exists.
+"""
+import json
+import os
+import timeit
+
+import numpy as np
+import pandas as pd
+
+ENGINE_PANDAS = 'pandas'
+ENGINE_NUMEXPR = 'numexpr'
+ENGINE_AUTO = 'auto'
+ENGINES = (ENGINE_PANDAS, ENGINE_NUMEXPR, ENGINE_AUTO)
+
+# used when nothing has been calibrated
+DEFAULT_THRESHOLD = 100000
+CALIBRATION_FILE = os.path.join(os.path.expanduser('~'),
+                                '.pandas_composition.json')
+
+options = {'engine': ENGINE_PANDAS, 'threshold': None}
+_calibration_loaded = False
+
+ops = {}
+ops['__add__'] = '+'
+ops['__radd__'] = '+'
+ops['__sub__'] = '-'
+ops['__rsub__'] = '-'
+ops['__mul__'] = '*'
+ops['__rmul__'] = '*'
+ops['__div__'] = '/'
+ops['__rdiv__'] = '/'
+ops['__truediv__'] = '/'
+ops['__rtruediv__'] = '/'
+ops['__pow__'] = '**'
+ops['__rpow__'] = '**'
+ops['__lt__'] = '<'
+ops['__le__'] = '<='
+ops['__eq__'] = '=='
+ops['__ne__'] = '!='
+ops['__gt__'] = '>'
+ops['__ge__'] = '>='
+reflected_op = set(['__radd__', '__rsub__', '__rmul__', '__rdiv__',
+                    '__rtruediv__', '__rpow__'])
+comparison_op = set(['<', '<=', '==', '!=', '>', '>='])
+# numexpr does integer / and ** differently from pandas
+float_op = set(['/', '**'])
+
+# dtypes numexpr handles the same as pandas
+_dtypes = set(np.dtype(dt) for dt in ['int32', 'int64', 'float32', 'float64'])
+# numexpr float literals are float64 and upcast float32 operands. pandas
+# keeps float32
+_scalar_dtypes = _dtypes - set([np.dtype('float32')])
+
+def set_engine(engine=None, threshold=None):
+    """ Set the global engine policy """
+    if engine is not None:
+        if engine not in ENGINES:
+            raise ValueError("engine must be one of {engines}".format(engines=ENGINES))
+        options['engine'] = engine
+    if threshold is not None:
+        options['threshold'] = threshold
+
+def get_engine(cls=None):
+    engine = getattr(cls, '_engine', None)
+    if engine is None:
+        engine = options['engine']
+    return engine
+
+def get_threshold(cls=None):
+    threshold = getattr(cls, '_engine_threshold', None)
+    if threshold is None:
+        threshold = options['threshold']
+    if threshold is None:
+        threshold = _load_calibration()
+    if threshold is None:
+        threshold = DEFAULT_THRESHOLD
+    return threshold
+
+def _load_calibration():
+    global _calibration_loaded
+    if not _calibration_loaded:
+        _calibration_loaded = True
+        try:
+            with open(CALIBRATION_FILE) as f:
+                options['threshold'] = json.load(f)['threshold']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+    return options['threshold']
+
+def _dtypes_ok(obj, kinds='if', allowed=_dtypes):
+    if isinstance(obj, pd.DataFrame):
+        dtypes = list(obj.dtypes)
+    elif isinstance(obj, (pd.Series, np.ndarray)):
+        dtypes = [obj.dtype]
+    elif isinstance(obj, (int, float, np.integer, np.floating)) \
+            and not isinstance(obj, (bool, np.bool_)):
+        dtypes = [np.asarray(obj).dtype]
+    else:
+        return False
+    return all(dt in allowed and dt.kind in kinds for dt in dtypes)
+
+def _same_labels(pobj, other):
+    if not pobj.index.equals(other.index):
+        return False
+    if isinstance(pobj, pd.DataFrame):
+        return pobj.columns.equals(other.columns)
+    return True
+
+def _supported(pobj, other, op):
+    """ Whether numexpr gives the same result pandas would """
+    allowed = _dtypes
+    if np.isscalar(other):
+        allowed = _scalar_dtypes
+    elif isinstance(other, np.ndarray):
+        if other.shape != pobj.shape:
+            return False
+    elif type(other) is not type(pobj):
+        # DataFrame/Series broadcasting differs from the lazy engine
+        return False
+    elif op in comparison_op and not _same_labels(pobj, other):
+        # pandas refuses to compare misaligned objects
+        return False
+    kinds = 'f' if op in float_op else 'if'
+    return _dtypes_ok(pobj, kinds, allowed) and _dtypes_ok(other, kinds)
+
+def use_numexpr(cls, size):
+    """ Whether cls evaluates operations of size elements with numexpr """
+    engine = get_engine(cls)
+    if engine == ENGINE_NUMEXPR:
+        return True
+    if engine == ENGINE_AUTO:
+        return size >= get_threshold(cls)
+    return False
+
+def evaluate_op(obj, name, other):
+    """
+    Evaluate the magic method `name` of a UserFrame/UserSeries with numexpr
+    when its engine policy asks for it. Returns None to leave it to pandas.
+    """
+    op = ops.get(name)
+    if op is None:
+        return None
+    pobj = obj.pobj
+    if not use_numexpr(type(obj), pobj.size):
+        return None
+    if hasattr(type(other), '_pandas_type'):
+        # an un-evaluated lazy object only holds an empty placeholder
+        if getattr(other, 'evaled', True) is False:
+            return None
+        other = other.pobj
+    if pobj.size == 0 or np.size(other) == 0:
+        return None
+    if not _supported(pobj, other, op):
+        return None
+
+    from pandas_composition.lazy import engine
+    from pandas_composition.lazy.expr import Operand, Scalar, BinOp
+    left = Operand(pobj)
+    right = Scalar(other) if np.isscalar(other) else Operand(other)
+    if name in reflected_op:
+        left, right = right, left
+    return engine.execute(BinOp(op, left, right))
+
+def _best(stmt, number, repeat):
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number
+
+def calibrate(sizes=None, ncols=10, repeat=3, path=None):
+    """
+    Measure the size where numexpr starts beating pandas for elementwise
+    arithmetic on this machine and use it as the global threshold.
+
+    Parameters
+    ----------
+    sizes : list of int
+        element counts to try
+    ncols : int
+        columns of the test frames
+    path : string, optional
+        save the result there. Nothing is written unless it is given.
+        Sessions load CALIBRATION_FILE, so pass that to keep using it
+
+    Returns
+    -------
+    threshold : int
+    """
+    from pandas_composition.lazy import engine
+    from pandas_composition.lazy.expr import Operand, BinOp
+
+    if sizes is None:
+        sizes = [10 ** 3, 10 ** 4, 3 * 10 ** 4, 10 ** 5, 3 * 10 ** 5, 10 ** 6,
+                 3 * 10 ** 6]
+    threshold = None
+    for size in sorted(sizes):
+        nrows = max(size // ncols, 1)
+        left = pd.DataFrame(np.random.randn(nrows, ncols))
+        right = pd.DataFrame(np.random.randn(nrows, ncols))
+        number = max(10 ** 6 // size, 1)
+        # operations are routed one at a time, so time a single one
+        pandas_time = _best(lambda: left + right, number, repeat)
+        expr = BinOp('+', Operand(left), Operand(right))
+        numexpr_time = _best(lambda: engine.execute(expr), number, repeat)
+        if numexpr_time < pandas_time:
+            if threshold is None:
+                threshold = size
+        else:
+            # numexpr has to keep winning for larger sizes
+            threshold = None
+    if threshold is None:
+        # never won. only use numexpr past everything we measured
+        threshold = max(sizes) * 10
+
+    options['threshold'] = threshold
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump({'threshold': threshold}, f)
+    return threshold
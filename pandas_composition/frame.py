@@ -5,6 +5,7 @@ import pandas as pd
 import numpy as np
 
 from six import with_metaclass
+from six.moves import copyreg
 
 NDFrame = pd.core.generic.NDFrame
 _internal_names = NDFrame._internal_names[:]
@@ -13,6 +14,12 @@ _internal_names.append('name')
 _internal_names = set(_internal_names)
 
 from pandas_composition.metaclass import PandasMeta
+from pandas_composition.base import (UserPandasObject, propagate_meta,
+                                     attach_pobj,
+                                     register_ipython_completers,
+                                     maybe_install_ipython_completers,
+                                     PickleBuffer, can_buffer, to_buffer,
+                                     from_buffer)
 
 def _get_meta(obj):
     # _get grabs from the obj itself and not it's pobj
@@ -30,9 +37,31 @@ def _get_meta(obj):
     meta.pop('_item_cache', None)
     return meta
 
+def _clone_boxed(boxed):
+    """
+    Copy-on-write clone of a cached boxed column. This way meta set on
+    the returned column does not persist into the frame. The pobj is a
+    shallow copy so setting name/index leaves the cache alone.
+    """
+    return attach_pobj(type(boxed), boxed.pobj.copy(deep=False),
+                       boxed._get('__dict__'), shared_with=boxed)
+
 class UserFrame(with_metaclass(PandasMeta, pd.DataFrame)):
     _pandas_type = pd.DataFrame
-    pobj = None
+    # pobj lives outside of __dict__ so that meta can be shared
+    # the boxed column cache and pending col stores are per frame and
+    # never shared or pickled
+    __slots__ = ('pobj', '_meta_shared', '_col_cache_', '_col_pending_')
+    # run __init__ when boxing results. See UserPandasObject._box
+    _box_init = False
+    # metadata propagation. See base.propagate_meta
+    # {attr: META_PROPAGATE | META_DROP | callable}
+    _meta_policy = None
+    # per method overrides. {method_name: {attr: policy}}
+    _meta_method_policy = None
+    # elementwise op engine. None uses the global policy. See compute
+    _engine = None
+    _engine_threshold = None
     def __new__(cls, *args, **kwargs):
         # only pass the kwargs that pandas want
         panda_kwargs = {k:v for k, v in kwargs.items() if k in cls._init_args}
@@ -40,6 +69,7 @@ class UserFrame(with_metaclass(PandasMeta, pd.DataFrame)):
 
         instance = object.__new__(cls)
         instance.pobj = pobj
+        maybe_install_ipython_completers()
         return instance
 
     def __init__(self, data=None, *args, **kwargs):
@@ -50,14 +80,61 @@ class UserFrame(with_metaclass(PandasMeta, pd.DataFrame)):
         """
         Initialize the col meta. This is for times when we create
         a UserFrame with a block of data such as dict, pd.DataFrame.
+
+        Only user class columns carry meta, so we never materialize
+        plain columns to look at them.
+        """
+        if isinstance(data, dict):
+            for k, v in data.items():
+                if hasattr(type(v), '_pandas_type'):
+                    self._store_meta(k, v)
+            return
+
+        # a plain pd.DataFrame has no col meta. A UserFrame hands over
+        # its stores, which are copied on first access
+        src = getattr(data, '_get', None)
+        if not callable(src):
+            return
+        # the source may still have its own stores pending
+        data._load_col_pending()
+        src_dict = src('__dict__')
+        classes = src_dict.get('_col_classes_')
+        if classes:
+            # snapshot, later changes to the source stay out of ours
+            meta = src_dict.get('_col_meta_') or {}
+            pending = (dict(classes),
+                       dict((k, dict(v)) for k, v in meta.items()))
+            object.__setattr__(self, '_col_pending_', pending)
+
+    def _load_col_pending(self):
+        """
+        Copy the col stores of the UserFrame we were constructed from,
+        limited to the columns we actually have.
         """
-        for k in data:
-            v = data[k]
-            self._store_meta(k, v)
+        try:
+            classes, meta = self._get('_col_pending_')
+        except AttributeError:
+            return
+        object.__delattr__(self, '_col_pending_')
+        columns = self.pobj.columns
+        col_classes = self._col_classes
+        col_meta = self._col_meta
+        for k, cls in classes.items():
+            if k in columns and k not in col_classes:
+                col_classes[k] = cls
+                col_meta[k] = meta.get(k, {})
+
+    def _box(self, pobj, method=None):
+        # pending col stores are not in the meta, so load them first
+        self._load_col_pending()
+        # UserPandasObject methods are copied into the class dict by
+        # PandasMeta, so it isn't in the mro for super
+        return UserPandasObject._box(self, pobj, method)
 
     _col_classes_ = None
     @property
     def _col_classes(self):
+        self._load_col_pending()
         if self._col_classes_ is None:
             self._col_classes_ = {}
         return self._col_classes_
@@ -65,6 +142,7 @@ class UserFrame(with_metaclass(PandasMeta, pd.DataFrame)):
     _col_meta_ = None
     @property
     def _col_meta(self):
+        self._load_col_pending()
         if self._col_meta_ is None:
             self._col_meta_ = {}
         return self._col_meta_
@@ -85,15 +163,47 @@ class UserFrame(with_metaclass(PandasMeta, pd.DataFrame)):
         if hasattr(val, 'name'):
             setattr(val, 'name', key)
         self._store_meta(key, val)
+        self._col_cache.pop(key, None)
         super(UserFrame, self).__setitem__(key, val)
 
+    def __delitem__(self, key):
+        self._col_cache.pop(key, None)
+        del self.pobj[key]
+
+    @property
+    def _col_cache(self):
+        """
+        Boxed columns keyed by column label.
+
+        Each entry is (raw, passthrough, boxed) where raw is the column
+        pandas returned from its item cache. pandas drops that cache on
+        setitem, deletion and in-place modification so a different raw
+        object means the entry is stale.
+        """
+        try:
+            return self._get('_col_cache_')
+        except AttributeError:
+            cache = {}
+            object.__setattr__(self, '_col_cache_', cache)
+            return cache
+
+    def _get_cached_column(self, key, raw, passthrough):
+        entry = self._col_cache.get(key)
+        if entry is None or entry[0] is not raw:
+            return None
+        cached_passthrough = entry[1]
+        for k, v in passthrough.items():
+            if cached_passthrough.get(k) is not v:
+                return None
+        return _clone_boxed(entry[2])
+
     def _wrap_series(self, key, val):
         """
         Wrap series data into correct class with metadata
         """
         if key in self._col_classes:
             cls = self._col_classes[key]
-            meta = self._col_meta[key]
+            meta = propagate_meta(cls, self._col_meta[key], '__getitem__')
             # TODO if cls is pd.Series, then this can error if
             # meta has a non init variable.
             val =  cls(val, **meta)
@@ -132,6 +242,10 @@ class UserFrame(with_metaclass(PandasMeta, pd.DataFrame)):
         """
         if boxer is None:
             return lambda x: x
+        # user classes box through their constructor. Series.view only
+        # knows about them when the patches are installed
+        if isinstance(boxer, type) and hasattr(boxer, '_pandas_type'):
+            return boxer
         if isinstance(boxer, type) and issubclass(boxer, np.ndarray):
             return lambda val: val.view(boxer)
         if isinstance(boxer, collections.Callable):
@@ -157,19 +271,66 @@ class UserFrame(with_metaclass(PandasMeta, pd.DataFrame)):
     def __getitem__(self, key):
         try:
             if key in self.columns:
-                val = super(UserFrame, self).__getitem__(key)
-                # attempt wrap
-                val = self._wrap_series(key, val)
-                if type(val) in [pd.Series, pd.TimeSeries]:
-                    # if pandas object, try to wrap default
-                    meta = self.boxer_passthrough()
-                    val = self.default_boxer(val, **meta)
-                return val
+                raw = super(UserFrame, self).__getitem__(key)
+                passthrough = self.boxer_passthrough()
+                val = self._get_cached_column(key, raw, passthrough)
+                if val is not None:
+                    return val
+                return self._box_column(key, raw, passthrough)
         except:
             # fallback to regular dataframe
             val = super(UserFrame, self).__getitem__(key)
             return val
 
+    def _box_column(self, key, raw, passthrough, boxer=None):
+        """
+        Box a raw column with its stored class/meta or the default
+        boxer and store the result in the col cache.
+        """
+        # attempt wrap
+        val = self._wrap_series(key, raw)
+        if type(val) in [pd.Series, pd.TimeSeries]:
+            # if pandas object, try to wrap default
+            if boxer is None:
+                boxer = self.default_boxer
+            val = boxer(val, **passthrough)
+        if hasattr(type(val), '_pandas_type'):
+            self._col_cache[key] = (raw, passthrough, val)
+            val = _clone_boxed(val)
+        return val
+
+    def box_columns(self, keys=None):
+        """
+        Box many columns in one pass.
+
+        Parameters
+        ----------
+        keys : list-like, optional
+            column labels. Defaults to all columns.
+
+        Returns a list of (key, column) pairs boxed the same as
+        `self[key]` would. The passthrough meta and default boxer are
+        only computed once and shared by all the columns.
+        """
+        pobj = self.pobj
+        if keys is None:
+            keys = pobj.columns
+        passthrough = self.boxer_passthrough()
+        boxer = self.default_boxer
+
+        items = []
+        for key in keys:
+            raw = pobj[key]
+            if not isinstance(raw, pd.Series):
+                # duplicate column labels
+                items.append((key, raw))
+                continue
+            val = self._get_cached_column(key, raw, passthrough)
+            if val is None:
+                val = self._box_column(key, raw, passthrough, boxer)
+            items.append((key, val))
+        return items
+
     def __tr_getattr__(self, key):
         """
         __tr_getattr__ runs before trying to grab from the
@@ -192,32 +353,128 @@ class UserFrame(with_metaclass(PandasMeta, pd.DataFrame)):
             raise Exception("Failed getting attribute")
         return res
 
-    #  For now just a dummy method to test subclasses overridding superclasses
+    # sentinel is there to test subclasses overridding superclasses
     def iteritems(self, sentinel=False):
         if sentinel:
             return 10
-        return ((k, self[k]) for k in self)
+        return iter(self.box_columns())
 
     # needed to trigger pickle to use UserFrame pickling methods
-    __reduce_ex__ = object.__reduce_ex__
+    def __reduce_ex__(self, protocol):
+        # protocol 5 can send the data out-of-band. see _buffer_state
+        if protocol >= 5 and PickleBuffer is not None:
+            state = self._buffer_state()
+            if state is not None:
+                return copyreg.__newobj__, (type(self),), state
+        return object.__reduce_ex__(self, protocol)
 
     def __getstate__(self):
         """
         Expicitly split up pobj and frame_meta.
         """
         data = {}
-        fdict = self._get('__dict__').copy()
-        pobj = fdict.pop('pobj')
-        data['pobj'] = pobj
+        self._load_col_pending()
+        fdict = propagate_meta(type(self), self._get('__dict__'), '__getstate__')
+        fdict = fdict.copy()
+        data['pobj'] = self.pobj
         data['frame_meta'] = fdict
         data['version'] = 1
         return data
 
+    def _buffer_state(self):
+        """
+        Version 2 state. Numeric columns are PickleBuffers, which pickle
+        protocol 5 hands to buffer_callback instead of copying them into
+        the stream. Labels, other columns and meta stay in-band.
+
+        Adjacent numeric columns of one dtype are sent as a single buffer,
+        in whichever orientation they are already contiguous in. Only a
+        frame of one numeric dtype loads without copying. None when no
+        column is numeric.
+        """
+        pobj = self.pobj
+        dtypes = list(pobj.dtypes)
+        runs = _numeric_runs(dtypes)
+        if not runs:
+            return None
+        blocks = []
+        for start, stop in runs:
+            values = pobj.iloc[:, start:stop].values
+            # frames built from a 2-D array keep it row by row. pandas
+            # stores the rest by column, where values.T is contiguous
+            transposed = not values.flags.c_contiguous
+            if transposed:
+                values = values.T
+            blocks.append((list(range(start, stop)), dtypes[start].str,
+                           transposed, to_buffer(values)))
+        numeric = set(i for start, stop in runs for i in range(start, stop))
+        others = [i for i in range(len(dtypes)) if i not in numeric]
+
+        data = {}
+        self._load_col_pending()
+        fdict = propagate_meta(type(self), self._get('__dict__'), '__getstate__')
+        data['frame_meta'] = fdict.copy()
+        data['index'] = pobj.index
+        data['columns'] = pobj.columns
+        data['blocks'] = blocks
+        data['others'] = (others, pobj.iloc[:, others]) if others else None
+        data['version'] = 2
+        return data
+
     def __setstate__(self, state):
         version = state['version']
         if version == 1:
             self.pobj = state['pobj']
             self._get('__dict__').update(state['frame_meta'])
+        if version == 2:
+            self.pobj = _frame_from_buffers(state)
+            self._get('__dict__').update(state['frame_meta'])
+
+def _numeric_runs(dtypes):
+    """ (start, stop) of adjacent columns with the same numeric dtype """
+    runs = []
+    start = 0
+    for i in range(1, len(dtypes) + 1):
+        if i < len(dtypes) and dtypes[i] == dtypes[start]:
+            continue
+        if can_buffer(dtypes[start]):
+            runs.append((start, i))
+        start = i
+    return runs
+
+def _block_values(nrows, block):
+    """ (rows, columns) array over the buffer of a version 2 block """
+    positions, dtype, transposed, buf = block
+    if transposed:
+        return from_buffer(buf, dtype, (len(positions), nrows)).T
+    return from_buffer(buf, dtype, (nrows, len(positions)))
+
+def _frame_from_buffers(state):
+    """
+    DataFrame of a version 2 pickle state. see UserFrame._buffer_state
+
+    A single block is wrapped as is. Otherwise the DataFrame is built
+    from the columns and pandas copies them into its own blocks.
+    """
+    index = state['index']
+    columns = state['columns']
+    blocks = state['blocks']
+    if len(blocks) == 1 and len(blocks[0][0]) == len(columns):
+        values = _block_values(len(index), blocks[0])
+        return pd.DataFrame(values, index=index, columns=columns)
+
+    data = {}
+    for block in blocks:
+        values = _block_values(len(index), block)
+        data.update(zip(block[0], values.T))
+    if state['others'] is not None:
+        positions, others = state['others']
+        for j, i in enumerate(positions):
+            data[i] = others.iloc[:, j]
+    # positions as keys so duplicate column names survive
+    frame = pd.DataFrame(data, index=index, columns=list(range(len(columns))))
+    frame.columns = columns
+    return frame
 
 # IPYTHON
 def install_ipython_completers():  # pragma: no cover
@@ -238,11 +495,4 @@ def install_ipython_completers():  # pragma: no cover
                        if isinstance(c, basestring) and py3compat.isidentifier(c)]
         return completions
 
-# Importing IPython brings in about 200 modules, so we want to avoid it unless
-# we're in IPython (when those modules are loaded anyway).
-import sys
-if "IPython" in sys.modules:  # pragma: no cover
-    try:
-        install_ipython_completers()
-    except Exception:
-        pass
+register_ipython_completers(install_ipython_completers)
@@ -1,14 +1,24 @@
-from collections import deque
-
 import numpy as np
 import pandas as pd
 import numexpr as ne
 
-from pandas_composition import UserFrame
+from six import with_metaclass
+
+from pandas_composition import UserFrame, UserSeries, PandasSuperMeta
+from pandas_composition.base import attach_pobj
+from pandas_composition.lazy import expr, engine, reduction, introspect, remote
+from pandas_composition.lazy.cache import program_cache, result_cache
+from pandas_composition.lazy.executor import get_executor, set_executor
+from pandas_composition.lazy.remote import SharedMemoryStore, FileStore
+from pandas_composition.lazy.expr import (Operand, Scalar, BinOp, UnaryOp, Func,
+                                          Select)
+
+# where, log, exp, sqrt and abs are left out so a star import doesn't
+# shadow the builtins. Use lazy.where or func('where', ...)
+__all__ = ['LazyFrame', 'LazySeries', 'func', 'select', 'evaluate_many',
+           'program_cache', 'result_cache', 'get_executor', 'set_executor',
+           'SharedMemoryStore', 'FileStore']
 
-deferred_op = ['__add__', '__sub__', '__mul__', '__div__', '__pow__', 
-               '__radd__', '__rsub__', '__rmul__', '__rdiv__', '__rpow__']
-eval_op = ['__array__', '.values']
 op_trans = {}
 op_trans['__add__'] = '+'
 op_trans['__radd__'] = '+'
@@ -18,98 +28,429 @@ op_trans['__mul__'] = '*'
 op_trans['__rmul__'] = '*'
 op_trans['__div__'] = '/'
 op_trans['__rdiv__'] = '/'
+op_trans['__truediv__'] = '/'
+op_trans['__rtruediv__'] = '/'
 op_trans['__pow__'] = '**'
 op_trans['__rpow__'] = '**'
-
-class PandasExpression(object):
-    def __init__(self, right, op):
-        self.right = right
-        self.op = op
+op_trans['__mod__'] = '%'
+op_trans['__rmod__'] = '%'
+op_trans['__lt__'] = '<'
+op_trans['__le__'] = '<='
+op_trans['__eq__'] = '=='
+op_trans['__ne__'] = '!='
+op_trans['__gt__'] = '>'
+op_trans['__ge__'] = '>='
+op_trans['__and__'] = '&'
+op_trans['__rand__'] = '&'
+op_trans['__or__'] = '|'
+op_trans['__ror__'] = '|'
+# reflected ops have self as the right operand
+reflected_op = set(['__radd__', '__rsub__', '__rmul__', '__rdiv__',
+                    '__rtruediv__', '__rpow__', '__rmod__', '__rand__',
+                    '__ror__'])
+unary_op = {'__neg__': '-', '__invert__': '~'}
+deferred_op = list(op_trans) + list(unary_op)
+eval_op = ['__array__', '.values']
 
 def lazy(self):
     return LazyFrame(self)
 
 pd.DataFrame.lazy = lazy
 
-class LazyFrame(UserFrame):
+def lazy_series(self):
+    return LazySeries(self)
+
+pd.Series.lazy = lazy_series
+
+def _is_lazy(obj):
+    return isinstance(obj, (LazyFrame, LazySeries))
+
+def to_node(obj):
+    """ Turn a LazyFrame/LazySeries, scalar or data into an expression node """
+    if _is_lazy(obj):
+        return obj._node()
+    if isinstance(obj, expr.Node):
+        return obj
+    if np.isscalar(obj):
+        return Scalar(obj)
+    return Operand(obj)
+
+def _is_frame(obj):
+    if isinstance(obj, (LazyFrame, pd.DataFrame)):
+        return True
+    return isinstance(obj, np.ndarray) and obj.ndim == 2
+
+def _check_series(objs):
+    """
+    pandas aligns a Series with a DataFrame on the columns, the lazy
+    engine aligns on the index. Refuse plain Series with frames instead
+    of silently giving a different result.
     """
-    DataFrame that defers doing operations until it has to. 
+    if not any(_is_frame(obj) for obj in objs):
+        return
+    for obj in objs:
+        if isinstance(obj, pd.Series) and not _is_lazy(obj):
+            raise ValueError("A pandas Series combined with a LazyFrame would "
+                             "align on the index, pandas aligns it on the "
+                             "columns. Use series.lazy() to align on the "
+                             "index or series.values to broadcast across "
+                             "the rows")
 
-    An un-evaled LazyFrame will have an empty DataFrame for 
-    `self.pobj`.
+def _from_node(node, objs):
+    """
+    Wrap node in a LazyFrame if any of objs is 2-D, else a LazySeries
+    """
+    klass = LazySeries
+    if any(_is_frame(obj) for obj in objs):
+        klass = LazyFrame
+    return _new(klass, node)
 
-    Once a LazyFrame is evaled, it will act like an Ordinary
-    DataFrame. Or more precisely, a UserFrame.
+def _new(klass, node):
+    # un-evaled objects share an empty pobj. No pandas constructors run
+    # so building an expression is constant time per operation.
+    return attach_pobj(klass, klass._empty_pobj, {'_expr': node})
+
+def _own_pobj(obj):
     """
-    def __init__(self, *args, **kwargs):
-        super(LazyFrame, self).__init__(*args, **kwargs)
-        self.expressions = deque() 
-        self.add_expr(self.pobj, None)
+    Evaluate obj before something is written to its pobj. The empty pobj
+    of un-evaled objects is shared, so the write would show on all of them.
+    """
+    if obj.pobj is type(obj)._empty_pobj:
+        obj.eval(inplace=True)
 
-        evaled = kwargs.pop('evaled', False)
-        self.evaled = evaled
-        if not evaled:
-            self.pobj = pd.DataFrame() # un evaluate
+def select(obj, rows=None, columns=None, squeeze=False):
+    """
+    Defer selecting rows/columns of obj. See expr.Select
+
+    >>> select(lf, rows=('iloc', slice(-100, None)))
+    """
+    klass = LazyFrame
+    if squeeze or isinstance(obj, LazySeries):
+        klass = LazySeries
+    return _new(klass, Select(obj._node(), rows, columns, squeeze))
+
+def _is_label(key):
+    if isinstance(key, (slice, np.ndarray, pd.Series, pd.DataFrame,
+                        LazyFrame, LazySeries)):
+        return False
+    try:
+        hash(key)
+    except TypeError:
+        return False
+    return True
+
+def _is_everything(key):
+    return isinstance(key, slice) and key == slice(None)
 
-    def add_expr(self, right, op):
-        expr = PandasExpression(right, op)
-        self.expressions.append(expr)
+class _LazyIndexer(object):
+    """
+    .iloc/.loc of an un-evaled lazy object. Row slices and column lists or
+    slices are deferred. Anything else evaluates first.
+    """
+    def __init__(self, obj, kind):
+        self.obj = obj
+        self.kind = kind
+
+    def __getitem__(self, key):
+        rows, columns = key, None
+        if isinstance(key, tuple) and len(key) == 2:
+            rows, columns = key
+        if _is_everything(columns):
+            columns = None
+
+        deferrable = isinstance(rows, slice)
+        if columns is not None:
+            deferrable = (deferrable and isinstance(self.obj, LazyFrame)
+                          and isinstance(columns, (slice, list)))
+        if not deferrable:
+            self.obj.eval(inplace=True)
+            return self.obj._wrap(self.kind)[key]
+
+        if _is_everything(rows):
+            rows = None
+        if rows is not None:
+            rows = (self.kind, rows)
+        if columns is not None:
+            columns = (self.kind, columns)
+        return select(self.obj, rows, columns)
+
+def func(name, *args):
+    """
+    Defer a numexpr function call.
+
+    >>> func('log', lf)
+    """
+    if name not in expr.ne_funcs:
+        raise ValueError("{name} is not supported by numexpr".format(name=name))
+    _check_series(args)
+    return _from_node(Func(name, [to_node(arg) for arg in args]), args)
 
-    def eval(self, inplace=False):
+def where(cond, x, y):
+    return func('where', cond, x, y)
+
+def log(x):
+    return func('log', x)
+
+def exp(x):
+    return func('exp', x)
+
+def sqrt(x):
+    return func('sqrt', x)
+
+def abs(x):
+    return func('abs', x)
+
+def evaluate_many(objs, inplace=False, **kwargs):
+    """
+    Evaluate several lazy objects together.
+
+    Operands shared between them are aligned once and the evaluations run
+    concurrently on the background executor. See lazy.executor
+
+    Parameters
+    ----------
+    objs : list of LazyFrame/LazySeries
+    inplace : bool
+        keep each result as the object's data
+    kwargs : passed to cache.evaluate. i.e. block_size, dtype
+
+    Returns
+    -------
+    results : list of pandas objects in the order of objs
+    """
+    pending = [obj for obj in objs if not obj.evaled]
+    results = engine.execute_many([obj._node() for obj in pending],
+                                  get_executor(), result_cache, **kwargs)
+    evaluated = dict(zip(map(id, pending), results))
+
+    out = []
+    for obj in objs:
+        pobj = evaluated.get(id(obj))
+        if pobj is None:
+            pobj = obj.pobj
+        elif inplace:
+            obj.pobj = pobj
+            obj.evaled = True
+        out.append(pobj)
+    return out
+
+class LazyBase(PandasSuperMeta):
+    """
+    Deferred operator machinery shared by LazyFrame and LazySeries.
+
+    Operations are recorded as an expression tree (see lazy.expr) that
+    is compiled into a single numexpr evaluation. Lazy objects can be
+    combined with each other, with pandas objects and with scalars.
+    LazySeries are aligned on the index and broadcast across the columns
+    of frames in the same expression. pandas aligns a Series with a frame
+    on the columns instead, so plain Series can't be combined with frames.
+    """
+    evaled = False
+    _expr = None
+
+    def _node(self):
+        """ Expression node representing this object """
+        if self.evaled:
+            return Operand(self.pobj)
+        return self._expr
+
+    def eval(self, inplace=False, block_size=None, out=None, nthreads=None,
+             memo=result_cache, dtype=None):
+        """
+        Evaluate the expression.
+
+        Parameters
+        ----------
+        inplace : bool
+            keep the result as this object's data
+        block_size : int, optional
+            evaluate block_size rows at a time instead of all at once.
+            Keeps temporaries in cache and lets np.memmap operands be
+            streamed instead of read in whole.
+        out : ndarray, optional
+            preallocated array, i.e. an np.memmap, shaped like the result
+            (rows, columns) to write into. The result is backed by it.
+        nthreads : int, optional
+            numexpr threads to use for this evaluation
+        memo : ResultCache, optional
+            reuse results of expressions evaluated before. Only used once
+            its max_bytes is set. see lazy.cache
+        dtype : float32 or float64, optional
+            evaluate in dtype instead of the dtype numexpr picks from the
+            operands. Float and integer operands and float scalars are
+            cast to it, block by block, and the result is dtype. Boolean
+            operands are left alone, so comparisons and &, |, ~ still
+            give bool. Not memoized.
+
+        Sub-expressions that repeat are evaluated once. see engine.plan
+        Where the time went is shown by explain afterwards.
+        """
         # already evaled
-        if not self.pobj.empty:
+        if self.evaled:
             return self.pobj
 
-        full, ns = self.gen_ne()
-        res = ne.evaluate(full, local_dict=ns)
-        if res.ndim == 1:
-            pobj = pd.Series(res)
-        if res.ndim == 2:
-            pobj = pd.DataFrame(res)
+        # aligns once and keeps the labels. see lazy.engine
+        timings = introspect.Timings()
+        pobj = engine.execute(self._node(), memo, out=out, timings=timings,
+                              block_size=block_size, nthreads=nthreads,
+                              dtype=dtype)
+        # kept in a slot. meta is shared with boxed results and pickled
+        object.__setattr__(self, '_timings_', timings)
 
         if inplace:
             self.pobj = pobj
             self.evaled = True
         return pobj
 
+    def eval_async(self, **kwargs):
+        """
+        Evaluate on the background executor. Returns a
+        concurrent.futures.Future of the result. kwargs are passed to eval.
+        numexpr runs single threaded unless nthreads is given, so
+        evaluations on the pool overlap. See lazy.executor
+        """
+        kwargs.setdefault('nthreads', 1)
+        return get_executor().submit(self.eval, **kwargs)
+
+    def eval_awaitable(self, loop=None, **kwargs):
+        """
+        eval_async as an asyncio future
+
+        >>> res = await lf.eval_awaitable()
+        """
+        import asyncio
+        return asyncio.wrap_future(self.eval_async(**kwargs), loop=loop)
+
+    def explain(self):
+        """
+        Describe evaluating this object without doing it. Shows the
+        expression tree with the shape and dtype of every node, the
+        operands and estimated output and temporary bytes. After an eval,
+        also where its time went. see lazy.introspect
+
+        >>> print(lf.explain())
+        """
+        try:
+            timings = object.__getattribute__(self, '_timings_')
+        except AttributeError:
+            timings = None
+        return introspect.explain(self._node(), timings)
+
+    def to_graph(self, store):
+        """
+        Picklable form of the expression with its operands exported to
+        store, a SharedMemoryStore or FileStore. Evaluate it in another
+        process with remote.evaluate. see lazy.remote
+        """
+        return remote.dump(self._node(), store)
+
     def gen_ne(self):
         """
         Generate the values needed for numexpr
         Essentially a full string expression and a namespace
         """
-        sub_count = 1
-        ns = {}
-        subs = []
-        for expr in self.expressions:
-            val = expr.right
-            op = expr.op
-            if np.isscalar(val):
-                val = repr(val)
-            else:
-                placeholder = '_pobj'+str(sub_count)
-                sub_count += 1
-                assert placeholder not in ns
-                ns[placeholder] = val
-                val = placeholder
-
-            if op is None:
-                subs.append(val)
-                continue
-            else:
-                op = op_trans[op]
-                subs.append("{op} {val}".format(op=op, val=val))
-        full = self._gen_full_string(subs)
-        return full, ns
-
-    def _gen_full_string(self, subs):
-        if len(subs) == 1:
-            full = subs[0]
-            return full
-
-        full = '({left} {right})'.format(left=subs[0], right=subs[1])
-        for s in subs[2:]:
-            full = '({left} {right})'.format(left=full, right=s)
-        return full
+        return expr.gen_ne(self._node())
+
+    def defer_op(self, name, *args, **kwargs):
+        if name in unary_op:
+            return _from_node(UnaryOp(unary_op[name], self._node()), [self])
+
+        other = args[0]
+        _check_series([self, other])
+        left = self._node()
+        right = to_node(other)
+        if name in reflected_op:
+            left, right = right, left
+        return _from_node(BinOp(op_trans[name], left, right), [self, other])
+
+    def _reduce(self, how, axis=None, skipna=True, **kwargs):
+        """
+        Reduction compiled into the numexpr expression so the elementwise
+        result is never allocated. see lazy.reduction
+
+        Falls back to pandas once evaled or when given options numexpr
+        can't handle. i.e. level, numeric_only
+        """
+        if self.evaled or kwargs:
+            if how != 'count':
+                kwargs['skipna'] = skipna
+            return self._delegate(how, axis=axis, **kwargs)
+
+        full, ns = engine.plan(self._node(), result_cache)
+        arrays, wrap = engine.prepare(ns)
+        return reduction.reduce(how, full, arrays, wrap, axis=axis,
+                                skipna=skipna)
+
+    def sum(self, axis=None, skipna=True, **kwargs):
+        return self._reduce('sum', axis, skipna, **kwargs)
+
+    def mean(self, axis=None, skipna=True, **kwargs):
+        return self._reduce('mean', axis, skipna, **kwargs)
+
+    def prod(self, axis=None, skipna=True, **kwargs):
+        return self._reduce('prod', axis, skipna, **kwargs)
+
+    def min(self, axis=None, skipna=True, **kwargs):
+        return self._reduce('min', axis, skipna, **kwargs)
+
+    def max(self, axis=None, skipna=True, **kwargs):
+        return self._reduce('max', axis, skipna, **kwargs)
+
+    def count(self, axis=None, **kwargs):
+        """ Non-NaN values. (lf > 0).sum() counts the true values """
+        return self._reduce('count', axis, **kwargs)
+
+    @property
+    def iloc(self):
+        if self.evaled:
+            return self._wrap('iloc')
+        return _LazyIndexer(self, 'iloc')
+
+    @property
+    def loc(self):
+        if self.evaled:
+            return self._wrap('loc')
+        return _LazyIndexer(self, 'loc')
+
+    def head(self, n=5):
+        if self.evaled:
+            return self._delegate('head', n)
+        return select(self, rows=('iloc', slice(None, n)))
+
+    def tail(self, n=5):
+        if self.evaled:
+            return self._delegate('tail', n)
+        # -0 would select everything
+        rows = slice(-n, None) if n else slice(0, 0)
+        return select(self, rows=('iloc', rows))
+
+    def _repr_html_(self):
+        if self.evaled:
+            return self.pobj._repr_html_()
+        return repr(self)
+
+class LazyFrame(with_metaclass(LazyBase, UserFrame)):
+    """
+    DataFrame that defers doing operations until it has to.
+
+    An un-evaled LazyFrame will have an empty DataFrame for
+    `self.pobj`. It is shared by every un-evaled LazyFrame, so setting
+    pandas attributes or columns evaluates first.
+
+    Once a LazyFrame is evaled, it will act like an Ordinary
+    DataFrame. Or more precisely, a UserFrame.
+    """
+    __slots__ = ('_timings_',)
+    _empty_pobj = pd.DataFrame()
+
+    def __init__(self, *args, **kwargs):
+        super(LazyFrame, self).__init__(*args, **kwargs)
+        self._expr = Operand(self.pobj)
+
+        evaled = kwargs.pop('evaled', False)
+        self.evaled = evaled
+        if not evaled:
+            self.pobj = self._empty_pobj # un evaluate
 
     def _delegate(self, name, *args, **kwargs):
         if name in deferred_op:
@@ -120,19 +461,94 @@ class LazyFrame(UserFrame):
             self.eval(inplace=True)
         return super(LazyFrame, self)._delegate(name, *args, **kwargs)
 
-    def defer_op(self, name, *args, **kwargs):
-        stack = LazyFrame()
-        stack.expressions = deque(self.expressions)
-        stack.add_expr(args[0], name)
-        return stack
+    def __setattr__(self, name, value):
+        if name != 'pobj' and hasattr(self._empty_pobj, name):
+            _own_pobj(self)
+        super(LazyFrame, self).__setattr__(name, value)
+
+    def __setitem__(self, key, val):
+        _own_pobj(self)
+        super(LazyFrame, self).__setitem__(key, val)
+
+    def __delitem__(self, key):
+        _own_pobj(self)
+        super(LazyFrame, self).__delitem__(key)
+
+    def __getitem__(self, key):
+        # column selection is deferred. see engine.pushdown
+        if not self.evaled:
+            if isinstance(key, (list, pd.Index)):
+                return select(self, columns=('loc', list(key)))
+            if _is_label(key):
+                return select(self, columns=('loc', [key]), squeeze=True)
+            self.eval(inplace=True)
+        return super(LazyFrame, self).__getitem__(key)
+
+    # unary ops are not always in the pandas class dict, so they
+    # wouldn't get wrapped by the metaclass
+    def __neg__(self):
+        return self.defer_op('__neg__')
+
+    def __invert__(self):
+        return self.defer_op('__invert__')
+
+    def __abs__(self):
+        return func('abs', self)
 
     def __repr__(self):
-        if self.pobj:
+        if self.evaled:
             return repr(self.pobj)
         full, ns = self.gen_ne()
         return "LazyFrame: \n{full}".format(full=full)
 
-    def _repr_html_(self):
-        if self.pobj:
-            return self.pobj._repr_html_()
-        return repr(self)
+class LazySeries(with_metaclass(LazyBase, UserSeries)):
+    """
+    Series counterpart of LazyFrame.
+
+    An un-evaled LazySeries will have an empty Series for `self.pobj`.
+    It is shared like LazyFrame's.
+    """
+    __slots__ = ('_timings_',)
+    _empty_pobj = pd.Series()
+
+    def __init__(self, *args, **kwargs):
+        super(LazySeries, self).__init__(*args, **kwargs)
+        self._expr = Operand(self.pobj)
+
+        evaled = kwargs.pop('evaled', False)
+        self.evaled = evaled
+        if not evaled:
+            self.pobj = self._empty_pobj # un evaluate
+
+    def _delegate(self, name, *args, **kwargs):
+        if name in deferred_op:
+            return self.defer_op(name, *args, **kwargs)
+        # if not deferred or part of pass safe-list
+        # we play it safe and eval
+        if name not in ['pobj']:
+            self.eval(inplace=True)
+        return super(LazySeries, self)._delegate(name, *args, **kwargs)
+
+    def __setattr__(self, name, value):
+        if name != 'pobj' and hasattr(self._empty_pobj, name):
+            _own_pobj(self)
+        super(LazySeries, self).__setattr__(name, value)
+
+    def __setitem__(self, key, val):
+        _own_pobj(self)
+        super(LazySeries, self).__setitem__(key, val)
+
+    def __neg__(self):
+        return self.defer_op('__neg__')
+
+    def __invert__(self):
+        return self.defer_op('__invert__')
+
+    def __abs__(self):
+        return func('abs', self)
+
+    def __repr__(self):
+        if self.evaled:
+            return repr(self.pobj)
+        full, ns = self.gen_ne()
+        return "LazySeries: \n{full}".format(full=full)
@@ -0,0 +1,395 @@
+"""
+Cache of compiled numexpr programs.
+
+ne.evaluate re-parses and compiles its expression string on every call.
+LazyFrame generates the same expression string for the same formula shape
+regardless of the data, so we compile each (expression, signature) once.
+"""
+from collections import OrderedDict
+import threading
+from timeit import default_timer
+
+import numpy as np
+import numexpr as ne
+from numexpr.necompiler import getType, getExprNames
+
+class Program(object):
+    """
+    Compiled ne.NumExpr program.
+
+    The compiled object wants ex_uses_vml whenever keyword arguments like
+    out are passed. ne.evaluate works it out from the expression, so we
+    do the same once at compile time.
+
+    A compiled object keeps its operands in itself while it runs, so it
+    can't be run by two threads at once. A thread finding it busy
+    compiles another one, which is kept for the next time.
+    """
+    def __init__(self, ex, signature):
+        self.ex = ex
+        self.signature = signature
+        self.uses_vml = getExprNames(ex, {})[1]
+        self._idle = [self._compile()]
+        self._lock = threading.Lock()
+
+    def _compile(self):
+        return ne.NumExpr(self.ex, signature=self.signature)
+
+    def __call__(self, *arrays, **kwargs):
+        if kwargs:
+            kwargs.setdefault('ex_uses_vml', self.uses_vml)
+        with self._lock:
+            program = self._idle.pop() if self._idle else None
+        if program is None:
+            program = self._compile()
+        try:
+            return program(*arrays, **kwargs)
+        finally:
+            with self._lock:
+                self._idle.append(program)
+
+class ProgramCache(object):
+    """
+    Bounded LRU cache of compiled ne.NumExpr programs.
+
+    Keyed by the normalized expression string plus the dtype and ndim of
+    every operand. Compiled programs don't depend on the operand lengths
+    so those are left out of the key.
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._programs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._programs)
+
+    def get(self, ex, names, arrays):
+        """
+        Return the compiled program for ex.
+
+        Parameters
+        ----------
+        ex : string
+            numexpr expression
+        names : list of strings
+            operand names in the order they'll be passed to the program
+        arrays : list of ndarray
+            operands
+        """
+        signature = tuple((name, getType(arr)) for name, arr in zip(names, arrays))
+        key = (ex, signature, tuple(arr.ndim for arr in arrays))
+        with self._lock:
+            prog = self._programs.pop(key, None)
+            if prog is not None:
+                self.hits += 1
+                self._programs[key] = prog
+                return prog
+            self.misses += 1
+
+        prog = Program(ex, signature)
+        with self._lock:
+            self._programs[key] = prog
+            while len(self._programs) > self.maxsize:
+                self._programs.popitem(last=False)
+        return prog
+
+    def clear(self):
+        with self._lock:
+            self._programs.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'maxsize': self.maxsize, 'size': len(self)}
+
+program_cache = ProgramCache()
+
+def _nbytes(value):
+    values = getattr(value, 'values', value)
+    return getattr(values, 'nbytes', 0)
+
+class ResultCache(object):
+    """
+    LRU cache of evaluated expressions, bounded by memory.
+
+    Keyed by the structure of the expression (see expr.structure), so
+    evaluating the same expression again, or another expression sharing
+    a sub-tree, reuses the result. Entries keep their operands alive so
+    the ids in the keys can't be reused by other objects.
+
+    Disabled until max_bytes is set. Results are not invalidated if an
+    operand is modified in place.
+
+    Values are pandas objects. Shallow copies are stored and handed out,
+    so renaming or adding columns to a result doesn't change the cached
+    one. The data itself is shared.
+    """
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._results.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._results[key] = entry
+        return entry[0].copy(deep=False)
+
+    def put(self, key, value, operands=()):
+        """ Store value. Skipped when it's bigger than max_bytes. """
+        nbytes = _nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        value = value.copy(deep=False)
+        with self._lock:
+            old = self._results.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._results[key] = (value, nbytes, list(operands))
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._results.popitem(last=False)
+                self.nbytes -= evicted[1]
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'max_bytes': self.max_bytes, 'nbytes': self.nbytes,
+                'size': len(self)}
+
+result_cache = ResultCache()
+
+def _block(arr, axis, length, rows):
+    """
+    Slice rows out of arr along axis. Arrays that are broadcast along
+    that axis are passed whole.
+    """
+    if arr.ndim == 0 or arr.shape[axis] != length:
+        return arr
+    index = [slice(None)] * arr.ndim
+    index[axis] = rows
+    return arr[tuple(index)]
+
+def _length(arrays, axis):
+    """ Number of rows along axis. None if every operand is a scalar """
+    sized = [arr for arr in arrays if arr.ndim]
+    if not sized:
+        return None
+    return max(arr.shape[axis] for arr in sized)
+
+# bytes of cast operands per block when evaluating with a dtype
+cast_block_bytes = 2 ** 20
+
+# dtypes evaluation can be done in
+_float_dtypes = set([np.dtype('float32'), np.dtype('float64')])
+
+def float_dtype(dtype):
+    """ dtype to evaluate in as np.dtype. Only float32/float64 """
+    dtype = np.dtype(dtype)
+    if dtype not in _float_dtypes:
+        raise ValueError("dtype must be float32 or float64, not {dtype}".format(
+            dtype=dtype))
+    return dtype
+
+def _cast_type(arr, dtype):
+    """
+    What arr is cast to when evaluating in dtype. None to leave it.
+
+    Floats and integers are cast, so integer expressions give dtype as
+    well. Booleans are left alone, so comparisons and &, |, ~ still give
+    bool.
+    """
+    if arr.dtype.kind in 'fiu' and arr.dtype != dtype:
+        return dtype
+    return None
+
+def _cast_block_size(arrays, axis):
+    """ Rows per block so a block of every operand is cast_block_bytes """
+    length = _length(arrays, axis)
+    if not length:
+        return 1
+    row_bytes = sum(arr.nbytes // length for arr in arrays
+                    if arr.ndim and arr.shape[axis] == length)
+    return max(1, cast_block_bytes // max(row_bytes, 1))
+
+def evaluate_blocks(prog, arrays, block_size, axis=-1, out=None, casts=None,
+                    dtype=None, **kwargs):
+    """
+    Run prog over row blocks of arrays, writing each block into out.
+
+    Only block_size rows of every operand are touched at a time. That
+    keeps the working set in cache and lets np.memmap operands be
+    streamed from disk instead of read in whole. out can be preallocated,
+    i.e. an np.memmap, and must have the result's shape. When it's None,
+    it is allocated after the first block tells us the dtype.
+
+    casts are the dtypes to cast each operand to, see _cast_type. Each
+    block is cast on its own, so no full size copies are made. A numeric
+    result is stored as dtype, bool results stay bool.
+    """
+    def cast(blocks):
+        if casts is None:
+            return blocks
+        return [block if to is None else block.astype(to)
+                for block, to in zip(blocks, casts)]
+
+    length = _length(arrays, axis)
+    if length is None:
+        res = prog(*cast(arrays), **kwargs)
+        if dtype is not None and res.dtype.kind in 'iuf':
+            res = res.astype(dtype)
+        return res
+
+    # whether prog can write into out without a cast
+    direct = False
+    for start in range(0, length, block_size):
+        rows = slice(start, min(start + block_size, length))
+        blocks = cast([_block(arr, axis, length, rows) for arr in arrays])
+        if direct:
+            prog(*blocks, out=_block(out, axis, length, rows), **kwargs)
+            continue
+        res = prog(*blocks, **kwargs)
+        if out is None:
+            shape = list(res.shape)
+            shape[axis] = length
+            out_dtype = res.dtype
+            if dtype is not None and res.dtype.kind in 'iuf':
+                out_dtype = dtype
+            out = np.empty(shape, dtype=out_dtype)
+        direct = out.dtype == res.dtype
+        _block(out, axis, length, rows)[...] = res
+    return out
+
+class NumThreads(object):
+    """
+    Guards numexpr's thread count, which is process wide.
+
+    Evaluations asking for their own count hold it from setting it until
+    the kernel returns and it is restored. Evaluations asking for the same
+    count share it. Others wait until it is released.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._nthreads = None
+        self._users = 0
+        self._restore = None
+
+    def acquire(self, nthreads):
+        with self._cond:
+            while self._users and self._nthreads != nthreads:
+                self._cond.wait()
+            if not self._users:
+                self._restore = ne.set_num_threads(nthreads)
+                self._nthreads = nthreads
+            self._users += 1
+
+    def release(self):
+        with self._cond:
+            self._users -= 1
+            if not self._users:
+                ne.set_num_threads(self._restore)
+                self._nthreads = None
+                self._cond.notify_all()
+
+num_threads = NumThreads()
+
+def evaluate(ex, ns, cache=None, block_size=None, axis=-1, nthreads=None,
+             timings=None, dtype=None, **kwargs):
+    """
+    Evaluate ex with the operands in ns through the program cache.
+
+    Parameters
+    ----------
+    block_size : int, optional
+        evaluate block_size rows at a time. see evaluate_blocks
+    axis : int
+        the row axis of the operands
+    nthreads : int, optional
+        numexpr threads to use for this evaluation only. Concurrent
+        evaluations asking for a different count wait, see NumThreads
+    timings : introspect.Timings, optional
+        add the compile and kernel time to it
+    dtype : float32 or float64, optional
+        cast float and integer operands to dtype and return it. Booleans
+        are left alone, so boolean expressions stay bool. Casting is done
+        block by block, cast_block_bytes at a time unless block_size is
+        given. Float literals in ex are still float64, see
+        engine.cast_literals
+
+    kwargs are passed to the compiled program. i.e. out, order, casting
+    """
+    if cache is None:
+        cache = program_cache
+    names = list(ns)
+    arrays = [np.asarray(ns[name]) for name in names]
+    casts = None
+    typed = arrays
+    if dtype is not None:
+        dtype = float_dtype(dtype)
+        casts = [_cast_type(arr, dtype) for arr in arrays]
+        # empty stand-ins to compile for the cast dtypes
+        typed = [arr if to is None else np.empty((0,) * arr.ndim, dtype=to)
+                 for arr, to in zip(arrays, casts)]
+        if block_size is None:
+            block_size = _cast_block_size(arrays, axis)
+    start = default_timer()
+    prog = cache.get(ex, names, typed)
+    if timings is not None:
+        timings.add('compile', default_timer() - start)
+
+    if nthreads is not None:
+        # numexpr only has a global setting
+        num_threads.acquire(nthreads)
+    start = default_timer()
+    try:
+        if block_size is None:
+            if kwargs.get('out') is None:
+                kwargs.pop('out', None)
+            return prog(*arrays, **kwargs)
+        return evaluate_blocks(prog, arrays, block_size, axis, casts=casts,
+                               dtype=dtype, **kwargs)
+    finally:
+        if timings is not None:
+            timings.add('kernel', default_timer() - start)
+        if nthreads is not None:
+            num_threads.release()
+
+def result_info(ex, ns, axis=-1, cache=None):
+    """
+    dtype and shape that ex evaluates to, without evaluating it.
+
+    The program is run on zero rows of every operand, which is enough
+    for numexpr to work out the result type.
+    """
+    if cache is None:
+        cache = program_cache
+    names = list(ns)
+    arrays = [np.asarray(ns[name]) for name in names]
+    length = _length(arrays, axis)
+    if length is not None:
+        arrays = [_block(arr, axis, length, slice(0, 0)) for arr in arrays]
+    res = cache.get(ex, names, arrays)(*arrays)
+    shape = list(res.shape)
+    if shape:
+        shape[axis] = length
+    return res.dtype, tuple(shape)
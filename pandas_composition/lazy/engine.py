@@ -0,0 +1,495 @@
+"""
+pandas side of LazyFrame evaluation.
+
+Turns the pandas operands of an expression into arrays numexpr can use and
+rebuilds a labeled pandas object from the result.
+"""
+from collections import OrderedDict
+from timeit import default_timer
+
+import numpy as np
+import pandas as pd
+
+from pandas_composition.lazy import expr
+from pandas_composition.lazy.cache import evaluate, float_dtype
+
+def _union(indexes):
+    """
+    Union of indexes. Skips the work when they are the same object.
+    """
+    target = indexes[0]
+    for ind in indexes[1:]:
+        if ind is target or ind.equals(target):
+            continue
+        target = target.union(ind)
+    return target
+
+def _same(ind, target):
+    return ind is target or ind.equals(target)
+
+class Layout(object):
+    """
+    Labels and orientation of the arrays made by prepare.
+
+    Calling it turns a numexpr result back into a labeled pandas object.
+    """
+    def __init__(self, index, columns, transposed, series_name):
+        self.index = index
+        self.columns = columns
+        self.transposed = transposed
+        self.series_name = series_name
+
+    @property
+    def row_axis(self):
+        """ Axis the rows are on in the prepared arrays """
+        return -1 if self.transposed else 0
+
+    def orient(self, arr):
+        """
+        Turn an array shaped like the result, i.e. a preallocated out,
+        into the orientation numexpr sees.
+        """
+        if arr is not None and self.transposed and arr.ndim == 2:
+            return arr.T
+        return arr
+
+    def reduce_axis(self, ndim, axis):
+        """
+        numexpr axis to reduce for pandas axis. None when the result is
+        1-D and reduces to a scalar.
+        """
+        if ndim < 2:
+            return None
+        rows = 1 if self.transposed else 0
+        return rows if axis == 0 else 1 - rows
+
+    def reduced(self, res, axis):
+        """ Label the result of reducing over pandas axis """
+        if res.ndim == 0:
+            return res[()]
+        labels = self.columns if axis == 0 else self.index
+        return pd.Series(res, index=labels)
+
+    def __call__(self, res):
+        index = self.index
+        if res.ndim == 2 and self.transposed:
+            return pd.DataFrame(res.T, index=index, columns=self.columns)
+        if res.ndim == 2 and self.columns is not None:
+            return pd.DataFrame(res, index=index, columns=self.columns)
+        if res.ndim == 2:
+            return pd.DataFrame(res)
+        if res.ndim == 1 and index is not None and len(res) == len(index):
+            return pd.Series(res, index=index, name=self.series_name)
+        if res.ndim == 1:
+            return pd.Series(res)
+        return res
+
+class Aligner(object):
+    """
+    Shares alignment work between prepare calls. i.e. evaluate_many
+
+    The union of the same indexes is computed once and is the same
+    object each time, so operands reindexed to it are reused as well.
+    Not thread-safe. Align in one thread and evaluate in others.
+    """
+    def __init__(self):
+        self._unions = {}
+        self._aligned = {}
+        # keyed by id, so keep the objects alive
+        self._keep = []
+
+    def union(self, indexes):
+        key = tuple(id(ind) for ind in indexes)
+        target = self._unions.get(key)
+        if target is None:
+            target = _union(indexes)
+            self._unions[key] = target
+            self._keep.append(indexes)
+        return target
+
+    def reindex(self, value, index, columns=None):
+        key = (id(value), id(index), id(columns))
+        aligned = self._aligned.get(key)
+        if aligned is None:
+            if columns is None:
+                aligned = value.reindex(index)
+            else:
+                aligned = value.reindex(index=index, columns=columns)
+            self._aligned[key] = aligned
+            self._keep.append(value)
+        return aligned
+
+def labels(values, aligner=None):
+    """
+    (index, columns) the pandas objects in values align to. None when
+    there are no Series/DataFrames, or no DataFrames for columns.
+    """
+    union = _union if aligner is None else aligner.union
+    frames = [value for value in values if isinstance(value, pd.DataFrame)]
+    series = [value for value in values if isinstance(value, pd.Series)]
+    index = None
+    columns = None
+    if frames or series:
+        index = union([obj.index for obj in frames + series])
+    if frames:
+        columns = union([frame.columns for frame in frames])
+    return index, columns
+
+def prepare(ns, aligner=None):
+    """
+    Align the pandas operands in ns once and turn them into arrays.
+
+    Parameters
+    ----------
+    ns : OrderedDict
+        {name: operand} as generated by expr.gen_ne
+    aligner : Aligner, optional
+        share alignment with other prepare calls
+
+    Returns
+    -------
+    arrays : OrderedDict
+        {name: ndarray} in the same order as ns
+    wrap : Layout
+        turns the numexpr result back into a labeled pandas object
+
+    Frames are aligned on both axes and Series on the index, the same
+    outer join pandas arithmetic does. Nothing is reindexed when the
+    labels already match.
+
+    2-D operands are passed in the orientation most frames are already
+    contiguous in, see transposed, so numexpr gets views instead of
+    strided arrays. The result is turned back, which is again a view.
+    """
+    index, columns = labels(ns.values(), aligner)
+    series = [value for value in ns.values() if isinstance(value, pd.Series)]
+
+    values = OrderedDict()
+    frames = []
+    for name, value in ns.items():
+        if isinstance(value, pd.DataFrame):
+            if not _same(value.index, index) or not _same(value.columns, columns):
+                if aligner is not None:
+                    value = aligner.reindex(value, index, columns)
+                else:
+                    value = value.reindex(index=index, columns=columns)
+            value = value.values
+            frames.append(value)
+        elif isinstance(value, pd.Series):
+            if not _same(value.index, index):
+                if aligner is not None:
+                    value = aligner.reindex(value, index)
+                else:
+                    value = value.reindex(index)
+            value = value.values
+        else:
+            value = np.asarray(value)
+        values[name] = value
+
+    flip = transposed(frames)
+    arrays = OrderedDict()
+    for name, arr in values.items():
+        if columns is None:
+            pass
+        elif isinstance(ns[name], pd.Series):
+            # broadcast across the columns
+            if not flip:
+                arr = arr[:, None]
+        elif arr.ndim == 2 and flip:
+            arr = arr.T
+        elif arr.ndim == 1:
+            # plain 1-D arrays broadcast across rows like pandas. Kept 2-D
+            # so blocked evaluation doesn't take their length for rows
+            arr = arr[:, None] if flip else arr[None, :]
+        arrays[name] = arr
+
+    names = set(s.name for s in series)
+    series_name = names.pop() if len(names) == 1 else None
+
+    return arrays, Layout(index, columns, flip, series_name)
+
+def _c_ordered(values):
+    """ Whether values, (rows, columns), is contiguous row by row """
+    return values.flags.c_contiguous and not values.flags.f_contiguous
+
+def transposed(frames):
+    """
+    Whether to pass 2-D operands to numexpr as (columns, rows).
+
+    frames are the values of the aligned DataFrame operands. A frame
+    built from a 2-D array keeps it, so values is C-contiguous. Frames
+    pandas put together itself, i.e. from a dict or by reindexing, are
+    stored by column and values.T is the contiguous one. The orientation
+    most frames have wins. Ties go to the pandas block layout.
+    """
+    if not frames:
+        return False
+    c_ordered = sum(1 for values in frames if _c_ordered(values))
+    return c_ordered * 2 <= len(frames)
+
+def _select_rows(value, index, rows):
+    if _same(value.index, index):
+        return value.iloc[rows]
+    return value.reindex(index[rows])
+
+def _select_value(value, index, columns, rows, cols, squeeze):
+    """ Select the aligned region rows/cols out of an operand """
+    if isinstance(value, pd.DataFrame):
+        if rows is not None:
+            value = _select_rows(value, index, rows)
+        if cols is None:
+            return value
+        target = columns[cols]
+        if not squeeze:
+            return value.reindex(columns=target)
+        label = target[0]
+        if label in value.columns:
+            return value[label]
+        return pd.Series(np.nan, index=value.index, name=label)
+
+    if isinstance(value, pd.Series):
+        if rows is not None:
+            value = _select_rows(value, index, rows)
+        if squeeze:
+            value = pd.Series(value.values, index=value.index,
+                              name=columns[cols][0])
+        return value
+
+    arr = np.asarray(value)
+    if rows is not None and arr.ndim:
+        arr = arr[rows]
+    if cols is not None and arr.ndim == 2:
+        arr = arr[:, cols[0]] if squeeze else arr[:, cols]
+    return arr
+
+def _positions(axis_labels, kind, key):
+    """ Positions in axis_labels selected by key """
+    positions = np.arange(len(axis_labels))
+    if kind == 'iloc':
+        return positions[key]
+    if isinstance(key, slice):
+        return positions[axis_labels.slice_indexer(key.start, key.stop, key.step)]
+    positions = axis_labels.get_indexer(key)
+    if (positions == -1).any():
+        missing = [k for k, pos in zip(key, positions) if pos == -1]
+        raise KeyError("{missing} not in index".format(missing=missing))
+    return positions
+
+def _apply_select(child, select):
+    leaves = expr.operands(child)
+    index, columns = labels([leaf.value for leaf in leaves])
+
+    rows = None
+    if select.rows is not None:
+        kind, key = select.rows
+        if kind == 'loc' and index is None:
+            raise KeyError("label selection needs pandas operands")
+        rows = key
+        if kind == 'loc':
+            rows = index.slice_indexer(key.start, key.stop, key.step)
+
+    cols = None
+    if select.columns is not None:
+        if columns is None:
+            raise KeyError("column selection needs a DataFrame operand")
+        cols = _positions(columns, *select.columns)
+
+    mapping = {}
+    for leaf in leaves:
+        value = _select_value(leaf.value, index, columns, rows, cols,
+                              select.squeeze)
+        mapping[id(leaf)] = expr.Operand(value, (select, leaf, leaves))
+    return expr.replace(child, mapping)
+
+def pushdown(root):
+    """
+    Tree without Select nodes. Each selection is done on the operands
+    under it so only the selected region gets computed.
+
+    Rows are selected from the aligned index, so positions and labels
+    mean the same as on the evaluated result.
+    """
+    selects = [node for node in expr.postorder(root)
+               if isinstance(node, expr.Select)]
+    if not selects:
+        return root
+    mapping = {}
+    # postorder, so inner selections are done first
+    for select in selects:
+        child = expr.replace(select.children[0], mapping)
+        mapping[id(select)] = _apply_select(child, select)
+    return expr.replace(root, mapping)
+
+def cast_literals(root, dtype):
+    """
+    Copy of root with numeric scalars turned into 0-d operands of dtype.
+
+    numexpr treats float literals as float64, so lf * 0.5 would be
+    evaluated in float64 even with float32 operands. Integer literals are
+    cast too, otherwise where(lf > 0, 1, 0) would stay an integer. Equal
+    scalars share an operand so common sub-expressions are still found.
+    """
+    dtype = float_dtype(dtype)
+    mapping = {}
+    operands = {}
+    for node in expr.postorder(root):
+        if not isinstance(node, expr.Scalar):
+            continue
+        value = node.value
+        if isinstance(value, (bool, np.bool_)):
+            continue
+        if not isinstance(value, (int, float, np.integer, np.floating)):
+            continue
+        sig = node.signature()
+        if sig not in operands:
+            operands[sig] = expr.Operand(np.array(node.value, dtype=dtype))
+        mapping[id(node)] = operands[sig]
+    if not mapping:
+        return root
+    return expr.replace(root, mapping)
+
+def _memo(memo):
+    if memo is None or not memo.max_bytes:
+        return None
+    return memo
+
+def _operand_values(node):
+    """ Data under node, including what selected operands came from """
+    values = []
+    stack = expr.operands(node)
+    while stack:
+        leaf = stack.pop()
+        values.append(leaf.value)
+        if leaf.origin is not None:
+            stack.extend(leaf.origin[2])
+    return values
+
+def _evaluate(full, ns, out=None, timings=None, **kwargs):
+    start = default_timer()
+    arrays, wrap = prepare(ns)
+    if timings is not None:
+        timings.add('align', default_timer() - start)
+    res = evaluate(full, arrays, axis=wrap.row_axis, out=wrap.orient(out),
+                   timings=timings, **kwargs)
+    return res, wrap
+
+def plan(root, memo=None, keys=None, timings=None, **kwargs):
+    """
+    numexpr expression and namespace for root, as expr.gen_ne, with
+    shared sub-trees evaluated first.
+
+    Sub-trees that are used more than once are evaluated once and passed
+    to the rest of the expression as operands. With memo, a ResultCache,
+    sub-trees evaluated before are taken from it and new ones are stored.
+    timings, an introspect.Timings, gets the time spent. kwargs are passed
+    to cache.evaluate.
+    """
+    memo = _memo(memo)
+    start = default_timer()
+    pushed = pushdown(root)
+    if timings is not None:
+        timings.add('align', default_timer() - start)
+    if keys is None or pushed is not root:
+        root = pushed
+        keys = expr.structure(root)
+    subs = {}
+    checked = set()
+
+    def prune(node):
+        key = keys[id(node)]
+        if key in subs:
+            return True
+        if memo is None or not node.children or node is root or key in checked:
+            return False
+        checked.add(key)
+        value = memo.get(key)
+        if value is None:
+            return False
+        subs[key] = value
+        return True
+
+    for node in expr.repeated(root, keys, prune):
+        key = keys[id(node)]
+        full, ns = expr.gen_ne(node, subs, keys)
+        res, wrap = _evaluate(full, ns, timings=timings, **kwargs)
+        if wrap.index is None:
+            # plain arrays. a default index would misalign them later
+            subs[key] = res
+            continue
+        subs[key] = wrap(res)
+        if memo is not None:
+            memo.put(key, subs[key], _operand_values(node))
+    return expr.gen_ne(root, subs, keys)
+
+def execute(root, memo=None, out=None, timings=None, **kwargs):
+    """
+    Evaluate the expression root into a labeled pandas object.
+
+    See plan. The result is stored in memo as well, unless it is being
+    written into out. timings, an introspect.Timings, gets the time spent.
+    """
+    start = default_timer()
+    memo = _memo(memo)
+    if kwargs.get('dtype') is not None:
+        # memo is keyed by structure, which doesn't include the dtype
+        memo = None
+        root = cast_literals(root, kwargs['dtype'])
+    keys = expr.structure(root)
+    key = keys[id(root)]
+    if memo is not None and out is None:
+        pobj = memo.get(key)
+        if pobj is not None:
+            if timings is not None:
+                timings.cached = True
+                timings.add('total', default_timer() - start)
+            return pobj
+
+    full, ns = plan(root, memo, keys, timings, **kwargs)
+    res, wrap = _evaluate(full, ns, out=out, timings=timings, **kwargs)
+    pobj = wrap(res)
+    if memo is not None and out is None and wrap.index is not None:
+        memo.put(key, pobj, _operand_values(root))
+    if timings is not None:
+        timings.add('total', default_timer() - start)
+    return pobj
+
+def execute_many(roots, executor, memo=None, **kwargs):
+    """
+    Evaluate several expressions, see execute.
+
+    Operands are aligned in this thread, sharing the work between
+    expressions. The numexpr evaluations are submitted to executor as
+    soon as each expression is aligned, so they overlap. They run numexpr
+    single threaded unless nthreads is given, see lazy.executor
+    """
+    pool_kwargs = dict(kwargs)
+    pool_kwargs.setdefault('nthreads', 1)
+    memo = _memo(memo)
+    dtype = kwargs.get('dtype')
+    if dtype is not None:
+        # see execute
+        memo = None
+    aligner = Aligner()
+    results = [None] * len(roots)
+    jobs = []
+    for i, root in enumerate(roots):
+        if dtype is not None:
+            root = cast_literals(root, dtype)
+        keys = expr.structure(root)
+        key = keys[id(root)]
+        if memo is not None:
+            results[i] = memo.get(key)
+            if results[i] is not None:
+                continue
+        full, ns = plan(root, memo, keys, **kwargs)
+        arrays, wrap = prepare(ns, aligner)
+        future = executor.submit(evaluate, full, arrays, axis=wrap.row_axis,
+                                 **pool_kwargs)
+        jobs.append((i, root, key, wrap, future))
+
+    for i, root, key, wrap, future in jobs:
+        pobj = wrap(future.result())
+        if memo is not None and wrap.index is not None:
+            memo.put(key, pobj, _operand_values(root))
+        results[i] = pobj
+    return results
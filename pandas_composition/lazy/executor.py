@@ -0,0 +1,50 @@
+"""
+Thread pool that lazy objects are evaluated on in the background.
+
+numexpr releases the GIL while it runs, so independent expressions on
+different threads overlap. Only when numexpr itself runs single
+threaded though, its multi-threaded evaluations take a global lock. So
+evaluations submitted here set numexpr to one thread while they run,
+see cache.NumThreads. Pass nthreads to use more.
+
+concurrent.futures is imported on first use. It needs the futures
+backport on python 2.
+"""
+import multiprocessing
+import threading
+
+_executor = None
+# whether we created _executor and should shut it down
+_owned = False
+_lock = threading.Lock()
+
+def get_executor():
+    """ Executor used for background evaluation. Created on first use. """
+    global _executor, _owned
+    with _lock:
+        if _executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _executor = ThreadPoolExecutor(max_workers=multiprocessing.cpu_count())
+            _owned = True
+        return _executor
+
+def set_executor(executor=None, max_workers=None):
+    """
+    Use executor, any concurrent.futures.Executor, for background
+    evaluation. With only max_workers, a new thread pool of that size is
+    created. With neither, the default pool is created again on next use.
+
+    A pool we created ourselves is shut down once replaced.
+    """
+    global _executor, _owned
+    if executor is None and max_workers is not None:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        owned = True
+    else:
+        owned = False
+    with _lock:
+        old, old_owned = _executor, _owned
+        _executor, _owned = executor, owned
+    if old is not None and old_owned:
+        old.shutdown(wait=False)
@@ -0,0 +1,320 @@
+"""
+Expression tree used by LazyFrame.
+
+Nodes are never mutated once created so sub-trees can be shared between
+expressions. Walks are iterative so that long chains of operations don't
+run into the recursion limit.
+"""
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+import numbers
+
+import numpy as np
+from six import with_metaclass
+
+class Key(object):
+    """
+    Structural key of a node. See structure
+
+    The hash is computed once. Keys contain the keys of their children,
+    so hashing a plain tuple would walk the whole sub-tree every time.
+    """
+    __slots__ = ('sig', '_hash')
+
+    def __init__(self, sig):
+        self.sig = sig
+        self._hash = hash(sig)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Key) or self._hash != other._hash:
+            return False
+        return self.sig == other.sig
+
+    def __ne__(self, other):
+        return not self == other
+
+class Node(with_metaclass(ABCMeta, object)):
+    """ Base expression node. Leaves have no children """
+    children = ()
+
+    @abstractmethod
+    def signature(self):
+        """ What this node computes, apart from its children """
+
+    def with_children(self, children):
+        """ Copy of this node with other children """
+        return self
+
+class Op(Node):
+    """ Node computed from its children """
+    @abstractmethod
+    def format(self, args):
+        """ numexpr string for this node given the strings of its children """
+
+class Operand(Node):
+    """
+    Leaf holding actual data. pandas object or ndarray
+
+    Operands engine.pushdown selects out of others have an origin,
+    (select, leaf, leaves): the Select, the operand the data was taken
+    from and every operand aligned with it. Their signature comes from
+    it, so the same selection of the same data gets the same key.
+    """
+    def __init__(self, value, origin=None):
+        self.value = value
+        self.origin = origin
+
+    def signature(self):
+        if self.origin is not None:
+            select, leaf, leaves = self.origin
+            return ('selected', select.signature(), leaf.signature(),
+                    tuple(other.signature() for other in leaves))
+        return ('operand', id(self.value))
+
+class Scalar(Node):
+    """ Leaf holding a scalar """
+    def __init__(self, value):
+        self.value = value
+
+    def signature(self):
+        return ('scalar', type(self.value), self.value)
+
+    def literal(self):
+        """
+        Return the scalar as a numexpr literal. None if it can't be
+        written as one. i.e. nan/inf
+        """
+        value = self.value
+        if isinstance(value, (bool, np.bool_)):
+            return repr(bool(value))
+        if isinstance(value, numbers.Integral):
+            return repr(int(value))
+        if isinstance(value, numbers.Real) and np.isfinite(value):
+            return repr(float(value))
+        return None
+
+class BinOp(Op):
+    """ Arithmetic, comparison and boolean binary operations """
+    def __init__(self, op, left, right):
+        self.op = op
+        self.children = (left, right)
+
+    @property
+    def left(self):
+        return self.children[0]
+
+    @property
+    def right(self):
+        return self.children[1]
+
+    def format(self, args):
+        return '({0} {op} {1})'.format(*args, op=self.op)
+
+    def signature(self):
+        return ('binop', self.op)
+
+    def with_children(self, children):
+        return BinOp(self.op, *children)
+
+class UnaryOp(Op):
+    def __init__(self, op, operand):
+        self.op = op
+        self.children = (operand,)
+
+    def format(self, args):
+        return '({op}{0})'.format(*args, op=self.op)
+
+    def signature(self):
+        return ('unary', self.op)
+
+    def with_children(self, children):
+        return UnaryOp(self.op, children[0])
+
+class Func(Op):
+    """ numexpr supported function. i.e. where, log, exp """
+    def __init__(self, name, args):
+        self.name = name
+        self.children = tuple(args)
+
+    def format(self, args):
+        return '{name}({args})'.format(name=self.name, args=', '.join(args))
+
+    def signature(self):
+        return ('func', self.name)
+
+    def with_children(self, children):
+        return Func(self.name, children)
+
+def _freeze(spec):
+    """ hashable version of a Select spec """
+    if spec is None:
+        return None
+    kind, key = spec
+    if isinstance(key, slice):
+        return (kind, 'slice', key.start, key.stop, key.step)
+    return (kind, tuple(key))
+
+class Select(Op):
+    """
+    Row/column selection of its operand. Never reaches numexpr,
+    engine.pushdown does the selection on the operands instead.
+
+    rows : ('iloc' | 'loc', slice)
+    columns : ('iloc' | 'loc', slice or list)
+    squeeze : the single selected column is returned as a Series
+    """
+    def __init__(self, operand, rows=None, columns=None, squeeze=False):
+        self.rows = rows
+        self.columns = columns
+        self.squeeze = squeeze
+        self.children = (operand,)
+
+    def format(self, args):
+        return 'select({0}, rows={rows}, columns={columns})'.format(
+            *args, rows=self.rows, columns=self.columns)
+
+    def signature(self):
+        return ('select', _freeze(self.rows), _freeze(self.columns),
+                self.squeeze)
+
+    def with_children(self, children):
+        return Select(children[0], self.rows, self.columns, self.squeeze)
+
+# functions numexpr knows how to evaluate
+ne_funcs = set(['where', 'log', 'log10', 'log1p', 'exp', 'expm1', 'sqrt',
+                'abs', 'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan',
+                'arctan2', 'sinh', 'cosh', 'tanh', 'arcsinh', 'arccosh',
+                'arctanh'])
+
+def postorder(root, prune=None):
+    """
+    Yield every node once, children before parents.
+
+    Nodes for which prune(node) is true are yielded without their children.
+    """
+    seen = set()
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in seen:
+            continue
+        if expanded:
+            seen.add(id(node))
+            yield node
+            continue
+        stack.append((node, True))
+        if prune is not None and prune(node):
+            continue
+        for child in reversed(node.children):
+            if id(child) not in seen:
+                stack.append((child, False))
+
+def operands(root):
+    """ All Operand leaves of root """
+    return [node for node in postorder(root) if isinstance(node, Operand)]
+
+def replace(root, mapping):
+    """
+    Copy of root with the nodes in mapping, {id(node): new node}, swapped.
+    Sub-trees without swapped nodes are shared with root.
+    """
+    new = {}
+    for node in postorder(root):
+        nid = id(node)
+        if nid in mapping:
+            new[nid] = mapping[nid]
+            continue
+        children = tuple(new[id(child)] for child in node.children)
+        if all(a is b for a, b in zip(children, node.children)):
+            new[nid] = node
+        else:
+            new[nid] = node.with_children(children)
+    return new[id(root)]
+
+def structure(root):
+    """
+    {id(node): Key} for every node of root.
+
+    Nodes get equal keys when they compute the same thing, the same
+    operations on the same data, even if they were built separately.
+    """
+    keys = {}
+    for node in postorder(root):
+        child_keys = tuple(keys[id(child)] for child in node.children)
+        keys[id(node)] = Key(node.signature() + child_keys)
+    return keys
+
+def repeated(root, keys, prune=None):
+    """
+    Non-leaf nodes whose structure is used more than once in root.
+    Innermost first and one node per key.
+    """
+    nodes = list(postorder(root, prune))
+    counts = {}
+    for node in nodes:
+        if prune is not None and prune(node):
+            continue
+        for child in node.children:
+            key = keys[id(child)]
+            counts[key] = counts.get(key, 0) + 1
+
+    found = []
+    seen = set()
+    for node in nodes:
+        key = keys[id(node)]
+        if not node.children or counts.get(key, 0) < 2 or key in seen:
+            continue
+        if prune is not None and prune(node):
+            continue
+        seen.add(key)
+        found.append(node)
+    return found
+
+def gen_ne(root, subs=None, keys=None):
+    """
+    Generate the values needed for numexpr
+    Essentially a full string expression and a namespace
+
+    The same data used multiple times gets a single name. Names are
+    given in a fixed walk order so the same formula shape always produces
+    the same string, and ns keeps that order.
+
+    subs is {Key: value} of sub-trees that were already evaluated. They
+    are passed as operands instead. keys is the structure of root.
+    """
+    prune = None
+    if subs:
+        if keys is None:
+            keys = structure(root)
+        prune = lambda node: keys[id(node)] in subs
+
+    strings = {}
+    ns = OrderedDict()
+    names = {}
+    for node in postorder(root, prune):
+        nid = id(node)
+        if prune is not None and prune(node):
+            # evaluated already. treat like an Operand
+            node = Operand(subs[keys[nid]])
+        if isinstance(node, Scalar):
+            literal = node.literal()
+            if literal is not None:
+                strings[nid] = literal
+                continue
+        if isinstance(node, (Operand, Scalar)):
+            key = id(node.value)
+            name = names.get(key)
+            if name is None:
+                name = '_pobj' + str(len(names) + 1)
+                names[key] = name
+                ns[name] = node.value
+            strings[nid] = name
+            continue
+        args = [strings[id(child)] for child in node.children]
+        strings[nid] = node.format(args)
+    return strings[id(root)], ns
@@ -0,0 +1,388 @@
+"""
+Introspection of lazy expressions. See LazyBase.explain
+
+Describes an evaluation before running it: the tree numexpr will get, the
+shape and dtype of every node and how many bytes get allocated. Nothing
+is evaluated. Selections are pushed down, so the tree shown is the one
+that runs.
+
+Evaluations record where their time went in a Timings.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from pandas_composition.lazy import expr, engine
+from pandas_composition.lazy.cache import ProgramCache
+
+# dtype programs are tiny. keep them out of the program_cache stats
+_dtype_cache = ProgramCache(maxsize=128)
+
+class Timings(object):
+    """
+    Seconds spent by an evaluation.
+
+    align : pushing down selections and aligning the operands
+    compile : compiling numexpr programs or finding them in program_cache
+    kernel : running numexpr
+    total : all of the above plus building the pandas result
+    cached : the result came from the result cache
+    """
+    phases = ['align', 'compile', 'kernel', 'total']
+
+    def __init__(self):
+        for phase in self.phases:
+            setattr(self, phase, 0.0)
+        self.cached = False
+
+    def add(self, phase, seconds):
+        setattr(self, phase, getattr(self, phase) + seconds)
+
+    def __repr__(self):
+        parts = ['{0} {1:.3f} ms'.format(phase, getattr(self, phase) * 1000)
+                 for phase in self.phases]
+        res = ', '.join(parts)
+        if self.cached:
+            res += ' (result cache hit)'
+        return res
+
+class NodeInfo(object):
+    """ What a node evaluates to. shape is (rows, columns) like pandas """
+    def __init__(self, label, shape, dtype):
+        self.label = label
+        self.shape = shape
+        self.dtype = dtype
+
+    @property
+    def nbytes(self):
+        if self.dtype is None:
+            return None
+        return _size(self.shape) * self.dtype.itemsize
+
+class OperandInfo(object):
+    """
+    An operand as given and as numexpr gets it after alignment. Shapes
+    are (rows, columns) like pandas. nbytes is what alignment copies. 0
+    when the data is used as is.
+    """
+    def __init__(self, name, kind, shape, dtype, aligned_shape, aligned_dtype,
+                 nbytes):
+        self.name = name
+        self.kind = kind
+        self.shape = shape
+        self.dtype = dtype
+        self.aligned_shape = aligned_shape
+        self.aligned_dtype = aligned_dtype
+        self.nbytes = nbytes
+
+def _size(shape):
+    return int(np.prod(shape)) if shape else 1
+
+def _format_bytes(nbytes):
+    if nbytes is None:
+        return '?'
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(nbytes) < 1024 or unit == 'GB':
+            break
+        nbytes /= 1024.0
+    if unit == 'B':
+        return '{0} B'.format(int(nbytes))
+    return '{0:.1f} {1}'.format(nbytes, unit)
+
+def _broadcast(shapes):
+    ndim = max([len(shape) for shape in shapes] + [0])
+    res = [1] * ndim
+    for shape in shapes:
+        for i, n in enumerate(shape, ndim - len(shape)):
+            if n != 1:
+                res[i] = n
+    return tuple(res)
+
+def _frame_dtype(frame):
+    dtypes = set(frame.dtypes)
+    if not dtypes:
+        return np.dtype(float)
+    try:
+        return np.result_type(*dtypes)
+    except TypeError:
+        # i.e. categoricals
+        return np.dtype(object)
+
+def _with_missing(dtype):
+    """ dtype after reindexing adds NaN """
+    if dtype.kind in 'iu':
+        return np.dtype(float)
+    if dtype.kind == 'b':
+        return np.dtype(object)
+    return dtype
+
+# stands in for the values of frames alignment copies. pandas builds
+# those by column
+_BLOCK_ORDERED = np.empty((2, 2), order='F')
+
+def _aligned(frame, index, columns):
+    return engine._same(frame.index, index) \
+        and engine._same(frame.columns, columns)
+
+def _transposed(values, index, columns):
+    """ engine.transposed of the DataFrames in values, without aligning """
+    frames = []
+    for value in values:
+        if not isinstance(value, pd.DataFrame):
+            continue
+        # .values of mixed dtypes is a copy, built by column as well
+        if len(set(value.dtypes)) > 1 or not _aligned(value, index, columns):
+            frames.append(_BLOCK_ORDERED)
+        else:
+            frames.append(value.values)
+    return engine.transposed(frames)
+
+def _operand_info(name, value, index, columns, transposed):
+    """
+    OperandInfo for value. Shapes are (rows, columns) like pandas.
+    Mirrors engine.prepare without copying anything.
+    """
+    if isinstance(value, pd.DataFrame):
+        kind = 'DataFrame'
+        shape = value.shape
+        dtype = _frame_dtype(value)
+        aligned_shape = (len(index), len(columns))
+        aligned_dtype = dtype
+        copied = len(set(value.dtypes)) > 1
+        if not _aligned(value, index, columns):
+            copied = True
+            if value.shape != aligned_shape:
+                aligned_dtype = _with_missing(dtype)
+    elif isinstance(value, pd.Series):
+        kind = 'Series'
+        shape = value.shape
+        dtype = value.dtype
+        aligned_shape = (len(index),)
+        if columns is not None and not transposed:
+            # kept 2-D to broadcast across the columns
+            aligned_shape = (len(index), 1)
+        aligned_dtype = dtype
+        copied = not engine._same(value.index, index)
+        if copied and len(value) != len(index):
+            aligned_dtype = _with_missing(dtype)
+    else:
+        arr = np.asarray(value)
+        kind = type(value).__name__
+        shape = arr.shape
+        dtype = arr.dtype
+        aligned_shape = shape
+        if columns is not None and arr.ndim == 1:
+            # broadcast across the rows
+            aligned_shape = (1, arr.shape[0])
+        aligned_dtype = dtype
+        copied = False
+    nbytes = _size(aligned_shape) * aligned_dtype.itemsize if copied else 0
+    return OperandInfo(name, kind, shape, dtype, aligned_shape, aligned_dtype,
+                       nbytes)
+
+def _node_dtype(node, child_dtypes):
+    """ dtype numexpr gives node, worked out on 0-d operands """
+    args = []
+    ns = OrderedDict()
+    for i, (child, dtype) in enumerate(zip(node.children, child_dtypes)):
+        if isinstance(child, expr.Scalar) and child.literal() is not None:
+            args.append(child.literal())
+            continue
+        if dtype is None:
+            return None
+        name = '_arg{0}'.format(i)
+        args.append(name)
+        ns[name] = np.zeros((), dtype=dtype)
+    names = list(ns)
+    arrays = list(ns.values())
+    try:
+        prog = _dtype_cache.get(node.format(args), names, arrays)
+        return prog(*arrays).dtype
+    except (ValueError, TypeError, KeyError):
+        # dtypes numexpr doesn't support. i.e. object
+        return None
+
+def _label(node, names):
+    if isinstance(node, expr.Operand):
+        return names[id(node.value)]
+    if isinstance(node, expr.Scalar):
+        return names.get(id(node.value), repr(node.value))
+    if isinstance(node, (expr.BinOp, expr.UnaryOp)):
+        return node.op
+    if isinstance(node, expr.Func):
+        return node.name + '()'
+    return type(node).__name__
+
+def explain(root, timings=None):
+    """
+    Explanation of evaluating the expression root.
+
+    timings, from an earlier evaluation, are shown along with it.
+    """
+    root = engine.pushdown(root)
+    full, ns = expr.gen_ne(root)
+    names = dict((id(value), name) for name, value in ns.items())
+    index, columns = engine.labels(ns.values())
+    transposed = _transposed(ns.values(), index, columns)
+
+    # shapes are broadcast in the orientation numexpr sees and shown
+    # like pandas. Reversing 2-D shapes goes either way
+    def orient(shape):
+        return shape[::-1] if transposed and len(shape) == 2 else shape
+
+    operands = OrderedDict()
+    for name, value in ns.items():
+        if np.isscalar(value):
+            continue
+        operands[name] = _operand_info(name, value, index, columns, transposed)
+
+    infos = {}
+    shapes = {}
+    for node in expr.postorder(root):
+        nid = id(node)
+        label = _label(node, names)
+        if isinstance(node, expr.Scalar):
+            shapes[nid] = ()
+            infos[nid] = NodeInfo(label, (), np.asarray(node.value).dtype)
+            continue
+        if isinstance(node, expr.Operand):
+            info = operands[names[id(node.value)]]
+            shapes[nid] = orient(info.aligned_shape)
+            infos[nid] = NodeInfo(label, info.shape, info.aligned_dtype)
+            continue
+        shape = _broadcast([shapes[id(child)] for child in node.children])
+        dtype = _node_dtype(node, [infos[id(child)].dtype
+                                   for child in node.children])
+        shapes[nid] = shape
+        infos[nid] = NodeInfo(label, orient(shape), dtype)
+
+    keys = expr.structure(root)
+    shared = expr.repeated(root, keys)
+    return Explanation(root, full, infos, operands, keys,
+                       set(keys[id(node)] for node in shared), timings)
+
+def _sum_bytes(values):
+    values = list(values)
+    if any(value is None for value in values):
+        return None
+    return sum(values)
+
+class Explanation(object):
+    """
+    What evaluating an expression does. See explain
+
+    Byte estimates:
+
+    output_bytes : the result
+    align_bytes : copies made to align operands
+    shared_bytes : sub-expressions used more than once. They are
+        evaluated once and kept for the rest of the expression
+    temp_bytes : align_bytes + shared_bytes. numexpr's own temporaries
+        are a few small blocks and left out
+    eager_bytes : intermediate results pandas would allocate evaluating
+        the same expression one operation at a time
+
+    None when a dtype numexpr doesn't support makes it unknown.
+    """
+    def __init__(self, root, expression, infos, operands, keys, shared,
+                 timings=None):
+        self.root = root
+        self.expression = expression
+        self.infos = infos
+        self.operands = operands
+        self.keys = keys
+        self.shared = shared
+        self.timings = timings
+
+    def info(self, node):
+        return self.infos[id(node)]
+
+    @property
+    def output_bytes(self):
+        return self.info(self.root).nbytes
+
+    @property
+    def align_bytes(self):
+        return sum(op.nbytes for op in self.operands.values())
+
+    @property
+    def shared_bytes(self):
+        nbytes = {}
+        for node in expr.postorder(self.root):
+            key = self.keys[id(node)]
+            if key in self.shared:
+                nbytes[key] = self.info(node).nbytes
+        return _sum_bytes(nbytes.values())
+
+    @property
+    def temp_bytes(self):
+        return _sum_bytes([self.align_bytes, self.shared_bytes])
+
+    @property
+    def eager_bytes(self):
+        return _sum_bytes(self.info(node).nbytes
+                          for node in expr.postorder(self.root)
+                          if node.children and node is not self.root)
+
+    def tree(self):
+        """ Lines of the expression tree, root first """
+        lines = []
+        printed = set()
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            info = self.info(node)
+            key = self.keys[id(node)]
+            note = ''
+            if key in self.shared:
+                note = 'shared'
+                if key in printed:
+                    note = 'shared, see above'
+            lines.append(('  ' * depth + info.label, info, note))
+            if note == 'shared, see above':
+                continue
+            printed.add(key)
+            for child in reversed(node.children):
+                stack.append((child, depth + 1))
+
+        width = max(len(label) for label, _, _ in lines)
+        res = []
+        for label, info, note in lines:
+            dtype = '?' if info.dtype is None else str(info.dtype)
+            line = '{0:<{width}}  {1:<8} {2:<14} {3}'.format(
+                label, dtype, str(info.shape), note, width=width)
+            res.append(line.rstrip())
+        return res
+
+    def __repr__(self):
+        lines = ['expression: ' + self.expression, '', 'tree:']
+        lines.extend('  ' + line for line in self.tree())
+
+        if self.operands:
+            lines.extend(['', 'operands:'])
+        for op in self.operands.values():
+            line = '  {0}  {1} {2} {3}'.format(op.name, op.kind, op.dtype,
+                                              op.shape)
+            if op.nbytes:
+                line += '  aligned to {0} {1}, copies {2}'.format(
+                    op.aligned_shape, op.aligned_dtype,
+                    _format_bytes(op.nbytes))
+            lines.append(line)
+
+        lines.extend([
+            '',
+            'estimated bytes:',
+            '  output       ' + _format_bytes(self.output_bytes),
+            '  temporaries  {0} (alignment {1}, shared {2})'.format(
+                _format_bytes(self.temp_bytes),
+                _format_bytes(self.align_bytes),
+                _format_bytes(self.shared_bytes)),
+            '  eager pandas ' + _format_bytes(self.eager_bytes),
+            '',
+        ])
+        if self.timings is None:
+            lines.append('timings: not evaluated')
+        else:
+            lines.append('timings: ' + repr(self.timings))
+        return '\n'.join(lines)
@@ -0,0 +1,128 @@
+"""
+Reductions fused into the numexpr expression.
+
+numexpr can reduce as the outermost operation of an expression, so
+lf.sum() computes the elementwise expression and sums it in one pass
+instead of allocating the elementwise result first.
+
+Follows pandas semantics: NaN are skipped unless skipna=False, integer
+and boolean expressions are summed as int64 and mean is always float.
+"""
+from collections import OrderedDict
+
+import numpy as np
+from numexpr.necompiler import getExprNames
+
+from pandas_composition.lazy.cache import evaluate, result_info
+
+reductions = ['sum', 'mean', 'prod', 'min', 'max', 'count']
+
+_axis_numbers = {0: 0, 1: 1, 'index': 0, 'rows': 0, 'columns': 1}
+
+# extra operands added to the namespace
+_LONG = '_reduce_long'
+_FILL = '_reduce_fill'
+
+def axis_number(axis):
+    if axis is None:
+        return 0
+    try:
+        return _axis_numbers[axis]
+    except (KeyError, TypeError):
+        raise ValueError("No axis named {axis}".format(axis=axis))
+
+def _run(how, ex, arrays, ne_axis):
+    if ne_axis is None:
+        full = '{how}({ex})'.format(how=how, ex=ex)
+    else:
+        full = '{how}({ex}, axis={axis})'.format(how=how, ex=ex, axis=ne_axis)
+    # numexpr won't take operands the expression doesn't use
+    names = set(getExprNames(full, {})[0])
+    ns = OrderedDict((name, arr) for name, arr in arrays.items() if name in names)
+    return evaluate(full, ns)
+
+def _count(ex, arrays, ne_axis):
+    """ Number of non-NaN values """
+    return _run('sum', 'where({0} == {0}, {1}, 0)'.format(ex, _LONG), arrays,
+                ne_axis)
+
+def reduce(how, ex, arrays, layout, axis=0, skipna=True):
+    """
+    Reduce the numexpr expression ex over pandas axis.
+
+    Parameters
+    ----------
+    how : string
+        one of reductions
+    ex : string
+        elementwise numexpr expression
+    arrays : OrderedDict
+        operands as returned by engine.prepare
+    layout : engine.Layout
+    """
+    if how not in reductions:
+        raise ValueError("{how} is not a supported reduction".format(how=how))
+    axis = axis_number(axis)
+    dtype, shape = result_info(ex, arrays, layout.row_axis)
+    ne_axis = layout.reduce_axis(len(shape), axis)
+    if len(shape) < 2 and axis != 0:
+        raise ValueError("No axis named {axis}".format(axis=axis))
+
+    arrays = OrderedDict(arrays)
+    arrays[_LONG] = np.array(1, dtype=np.int64)
+    kind = dtype.kind
+    nan_possible = kind in 'fc'
+    if kind == 'b':
+        ex = 'where({0}, {1}, 0)'.format(ex, _LONG)
+    elif kind in 'iu' and how in ('sum', 'prod', 'mean'):
+        # numexpr accumulates in the input type
+        ex = '({0} * {1})'.format(ex, _LONG)
+
+    if how == 'count':
+        if nan_possible:
+            return layout.reduced(_count(ex, arrays, ne_axis), axis)
+        n = np.prod(shape) if ne_axis is None else shape[ne_axis]
+        out_shape = tuple(np.delete(shape, ne_axis)) if ne_axis is not None else ()
+        return layout.reduced(np.full(out_shape, n, dtype=np.int64), axis)
+
+    skip = skipna and nan_possible
+    if how == 'mean':
+        if skip:
+            total = _run('sum', 'where({0} == {0}, {0}, 0)'.format(ex), arrays,
+                         ne_axis)
+            count = _count(ex, arrays, ne_axis)
+        else:
+            total = _run('sum', ex, arrays, ne_axis)
+            count = np.prod(shape) if ne_axis is None else shape[ne_axis]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            res = np.true_divide(total, count)
+        return layout.reduced(np.asarray(res), axis)
+
+    elem = ex
+    fill = None
+    if skip and how == 'sum':
+        fill = '0'
+    elif skip and how == 'prod':
+        fill = '1'
+    elif skip and how in ('min', 'max'):
+        fill = _FILL
+        arrays[_FILL] = np.array(np.inf if how == 'min' else -np.inf)
+    if fill is not None:
+        ex = 'where({0} == {0}, {0}, {1})'.format(ex, fill)
+
+    res = _run(how, ex, arrays, ne_axis)
+
+    if fill == _FILL:
+        # all NaN along the axis is NaN, not the fill value
+        filled = res == arrays[_FILL]
+        if filled.any():
+            count = _count(elem, arrays, ne_axis)
+            res = np.where(count == 0, np.nan, res)
+    elif nan_possible and how in ('min', 'max'):
+        # numexpr min/max skip NaN, any NaN along the axis is NaN
+        count = _count(elem, arrays, ne_axis)
+        n = np.prod(shape) if ne_axis is None else shape[ne_axis]
+        res = np.where(count < n, np.nan, res)
+    if kind == 'b' and how in ('min', 'max'):
+        res = res.astype(bool)
+    return layout.reduced(np.asarray(res), axis)
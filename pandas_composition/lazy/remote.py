@@ -0,0 +1,340 @@
+"""
+Expression graphs that can be sent to other processes.
+
+Pickling a lazy object would copy every operand into the pickle. dump
+turns an expression into a Graph instead: a list of node records plus
+OperandRefs pointing at data kept outside the pickle, in shared memory
+or in .npy files. Only the labels travel with the graph.
+
+    >>> with SharedMemoryStore() as store:
+    ...     graphs = [lf.to_graph(store) for lf in formulas]
+    ...     results = pool.map(remote.evaluate, graphs)
+
+A store exports each operand once, so graphs sharing data share the
+block. Workers map the data instead of copying it and send back only the
+result. evaluate unmaps the blocks when it returns. Stores free their
+data on close, so keep them open until the graphs have been evaluated.
+"""
+from abc import ABCMeta, abstractmethod
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+from six import with_metaclass
+
+from pandas_composition.lazy import expr, engine
+
+# shared memory blocks created by stores in this process, by name
+_created = {}
+# mappings that couldn't be closed because arrays still used them. Closing
+# them is retried whenever blocks are closed
+_unclosed = []
+_lock = threading.Lock()
+
+def _attach(name, attached):
+    """ Block name, mapped into this process. New mappings go in attached """
+    shm = _created.get(name)
+    if shm is not None:
+        return shm
+    from multiprocessing import shared_memory
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13 attaching registers the block with the
+        # resource tracker, which would unlink it when this process exits
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except (ImportError, AttributeError):
+            pass
+    attached.append(shm)
+    return shm
+
+def _close(blocks):
+    """
+    Close shared memory mappings. shm.close raises BufferError while
+    arrays still use a mapping, those are kept and tried again later.
+    """
+    with _lock:
+        pending = _unclosed + list(blocks)
+        del _unclosed[:]
+        for shm in pending:
+            try:
+                shm.close()
+            except BufferError:
+                _unclosed.append(shm)
+
+class SharedArray(object):
+    """ Handle of an array in a shared memory block """
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+
+    def open(self, attached):
+        """
+        The array, backed by the block. Nothing is copied. Blocks this
+        process maps for it are added to attached, see _close
+        """
+        shm = _attach(self.name, attached)
+        # frombuffer keeps a buffer export, so shm.close raises BufferError
+        # while the array is alive. np.ndarray(buffer=) doesn't on recent
+        # numpy and the block would be unmapped under it
+        count = int(np.prod(self.shape))
+        arr = np.frombuffer(shm.buf, dtype=self.dtype, count=count)
+        return arr.reshape(self.shape)
+
+class FileArray(object):
+    """ Handle of an array saved with np.save """
+    def __init__(self, path):
+        self.path = path
+
+    def open(self, attached):
+        """ The array, memory mapped read-only """
+        return np.load(self.path, mmap_mode='r')
+
+class OperandRef(object):
+    """
+    An operand of a Graph. The data is behind array, a SharedArray or
+    FileArray. Labels are kept here and pickled with the graph.
+
+    DataFrames are stored in whichever orientation their values are
+    contiguous in, values.T when transposed. Exporting and rebuilding
+    them doesn't copy, and engine.prepare picks the same orientation.
+    """
+    def __init__(self, array, kind, index=None, columns=None, name=None,
+                 transposed=False):
+        self.array = array
+        self.kind = kind
+        self.index = index
+        self.columns = columns
+        self.name = name
+        self.transposed = transposed
+
+    def resolve(self, attached):
+        arr = self.array.open(attached)
+        if self.kind == 'frame':
+            if self.transposed:
+                arr = arr.T
+            return pd.DataFrame(arr, index=self.index, columns=self.columns)
+        if self.kind == 'series':
+            return pd.Series(arr, index=self.index, name=self.name)
+        return arr
+
+def _split(value):
+    """ (array to store, OperandRef args) of an operand """
+    if isinstance(value, pd.DataFrame):
+        values = value.values
+        transposed = not engine._c_ordered(values)
+        if transposed:
+            values = values.T
+        return values, dict(kind='frame', index=value.index,
+                            columns=value.columns, transposed=transposed)
+    if isinstance(value, pd.Series):
+        return value.values, dict(kind='series', index=value.index,
+                                  name=value.name)
+    return np.asarray(value), dict(kind='array')
+
+class Store(with_metaclass(ABCMeta, object)):
+    """
+    Exports operands for Graphs. Subclasses implement _save and _free.
+
+    Each operand is exported once and kept alive, so its id can't be
+    reused by another object while the store is open.
+    """
+    def __init__(self):
+        self._refs = {}
+        self._keep = []
+
+    def export(self, value):
+        """ OperandRef of value """
+        ref = self._refs.get(id(value))
+        if ref is not None:
+            return ref
+        arr, kwargs = _split(value)
+        if arr.dtype.hasobject:
+            raise ValueError("object arrays can't be exported")
+        ref = OperandRef(self._save(np.ascontiguousarray(arr)), **kwargs)
+        self._refs[id(value)] = ref
+        self._keep.append(value)
+        return ref
+
+    @abstractmethod
+    def _save(self, arr):
+        """ Handle of a copy of arr, a SharedArray or FileArray """
+
+    @abstractmethod
+    def _free(self):
+        """ Free everything _save stored """
+
+    def close(self):
+        """ Free the exported data. Graphs using it can't be evaluated """
+        self._free()
+        self._refs.clear()
+        self._keep = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class SharedMemoryStore(Store):
+    """
+    Exports operands to multiprocessing.shared_memory blocks. Needs
+    python 3.8+.
+
+    close unlinks the blocks right away. Arrays of this process still
+    using a block, i.e. from load, keep it mapped until they are gone.
+    """
+    def __init__(self):
+        super(SharedMemoryStore, self).__init__()
+        self._blocks = []
+
+    def _save(self, arr):
+        from multiprocessing import shared_memory
+        # blocks can't be empty
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        self._blocks.append(shm)
+        # this process already has it mapped
+        _created[shm.name] = shm
+        return SharedArray(shm.name, arr.shape, arr.dtype)
+
+    def _free(self):
+        for shm in self._blocks:
+            _created.pop(shm.name, None)
+            shm.unlink()
+        _close(self._blocks)
+        self._blocks = []
+
+class FileStore(Store):
+    """
+    Exports operands to .npy files in directory, a temporary directory
+    by default. Works across machines when the directory is shared.
+    """
+    def __init__(self, directory=None):
+        super(FileStore, self).__init__()
+        self._owns_directory = directory is None
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='pandas_composition')
+        self.directory = directory
+        self._paths = []
+
+    def _save(self, arr):
+        fd, path = tempfile.mkstemp(suffix='.npy', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, arr)
+        self._paths.append(path)
+        return FileArray(path)
+
+    def _free(self):
+        for path in self._paths:
+            os.remove(path)
+        self._paths = []
+        if self._owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+def _record(node, children, operand):
+    if isinstance(node, expr.Operand):
+        return ('operand', operand)
+    if isinstance(node, expr.Scalar):
+        return ('scalar', node.value)
+    if isinstance(node, expr.BinOp):
+        return ('binop', node.op, children)
+    if isinstance(node, expr.UnaryOp):
+        return ('unary', node.op, children)
+    if isinstance(node, expr.Func):
+        return ('func', node.name, children)
+    if isinstance(node, expr.Select):
+        return ('select', (node.rows, node.columns, node.squeeze), children)
+    raise TypeError("Can't serialize {node}".format(node=type(node).__name__))
+
+def _node(record, nodes, operands):
+    kind = record[0]
+    if kind == 'operand':
+        return expr.Operand(operands[record[1]])
+    if kind == 'scalar':
+        return expr.Scalar(record[1])
+    children = [nodes[i] for i in record[2]]
+    if kind == 'binop':
+        return expr.BinOp(record[1], *children)
+    if kind == 'unary':
+        return expr.UnaryOp(record[1], children[0])
+    if kind == 'func':
+        return expr.Func(record[1], children)
+    if kind == 'select':
+        return expr.Select(children[0], *record[1])
+    raise ValueError("Unknown node record {kind}".format(kind=kind))
+
+class Graph(object):
+    """
+    Picklable form of an expression. See dump
+
+    nodes : list of records, children before parents. The last is the
+        root. Records refer to children by position, so shared sub-trees
+        stay shared.
+    operands : list of OperandRef
+    """
+    def __init__(self, nodes, operands):
+        self.nodes = nodes
+        self.operands = operands
+
+    def __repr__(self):
+        return 'Graph({nodes} nodes, {operands} operands)'.format(
+            nodes=len(self.nodes), operands=len(self.operands))
+
+def dump(root, store):
+    """ Graph of the expression root with its operands exported to store """
+    positions = {}
+    refs = {}
+    nodes = []
+    operands = []
+    for node in expr.postorder(root):
+        operand = None
+        if isinstance(node, expr.Operand):
+            key = id(node.value)
+            if key not in refs:
+                refs[key] = len(operands)
+                operands.append(store.export(node.value))
+            operand = refs[key]
+        children = tuple(positions[id(child)] for child in node.children)
+        positions[id(node)] = len(nodes)
+        nodes.append(_record(node, children, operand))
+    return Graph(nodes, operands)
+
+def load(graph, attached=None):
+    """
+    Expression tree of graph with its operands mapped in. Shared memory
+    blocks mapped for it are added to attached, to _close once the tree
+    is gone. Without attached they are closed by a later _close.
+    """
+    mapped = [] if attached is None else attached
+    operands = [ref.resolve(mapped) for ref in graph.operands]
+    if attached is None:
+        with _lock:
+            _unclosed.extend(mapped)
+    nodes = []
+    for record in graph.nodes:
+        nodes.append(_node(record, nodes, operands))
+    return nodes[-1]
+
+def evaluate(graph, **kwargs):
+    """
+    Evaluate graph into a pandas object. kwargs are passed to
+    engine.execute. i.e. block_size, dtype
+
+    Module level so it can be sent to a process pool. Shared memory
+    blocks are unmapped before returning, so long lived workers don't
+    keep every block they have seen.
+    """
+    attached = []
+    try:
+        return engine.execute(load(graph, attached), **kwargs)
+    finally:
+        # the tree is gone, nothing uses the blocks anymore
+        _close(attached)
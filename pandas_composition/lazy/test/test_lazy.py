@@ -2,11 +2,14 @@ from unittest import TestCase
 
 import numpy as np
 import pandas as pd
-from pandas_composition.lazy import LazyFrame
+from pandas_composition.lazy import LazyFrame, LazySeries
+import pandas_composition.lazy as lazy
 import pandas.util.testing as tm
 
 df = pd.DataFrame(np.random.randn(10000, 5))
 lf = LazyFrame(df)
+df2 = pd.DataFrame(np.random.randn(10000, 5))
+lf2 = LazyFrame(df2)
 
 class TestLazy(TestCase):
 
@@ -61,6 +64,632 @@ class TestLazy(TestCase):
         test = lf ** 10.0 + 1 + lf * lf
         tm.assert_almost_equal(correct.values, test.values)
 
+    def test_reflected(self):
+        """
+        Reflected ops should keep operand order
+        """
+        correct = 1 - df
+        test = 1 - lf
+        tm.assert_almost_equal(correct.values, test.values)
+
+        correct = 10.0 / df
+        test = 10.0 / lf
+        tm.assert_almost_equal(correct.values, test.values)
+
+        correct = 2 ** df
+        test = 2 ** lf
+        tm.assert_almost_equal(correct.values, test.values)
+
+    def test_nested(self):
+        """
+        Test combining LazyFrames with each other
+        """
+        correct = df * (df2 + 1)
+        test = lf * (lf2 + 1)
+        assert test.pobj.empty
+        tm.assert_almost_equal(correct.values, test.values)
+
+        correct = (df - df2) / (df + df2) ** 2
+        test = (lf - lf2) / (lf + lf2) ** 2
+        tm.assert_almost_equal(correct.values, test.values)
+
+        # pandas operands
+        correct = df * (df2 + 1)
+        test = lf * (df2 + 1)
+        tm.assert_almost_equal(correct.values, test.values)
+
+    def test_unary_and_bool(self):
+        correct = -df
+        test = -lf
+        tm.assert_almost_equal(correct.values, test.values)
+
+        correct = (df > 0) & (df2 < 0)
+        test = (lf > 0) & (lf2 < 0)
+        tm.assert_almost_equal(correct.values, test.values)
+
+        correct = ~(df > 0)
+        test = ~(lf > 0)
+        tm.assert_almost_equal(correct.values, test.values)
+
+    def test_funcs(self):
+        correct = np.where(df > 0, df, df2)
+        test = lazy.where(lf > 0, lf, lf2)
+        tm.assert_almost_equal(correct, test.values)
+
+        correct = np.log(np.abs(df)) + np.exp(df2)
+        test = lazy.log(abs(lf)) + lazy.exp(lf2)
+        tm.assert_almost_equal(correct.values, test.values)
+
+        # single expression
+        full, ns = test.gen_ne()
+        assert full.count('log') == 1
+        assert len(ns) == 2
+
+    def test_star_import(self):
+        """
+        Star imports don't shadow builtins and nodes are abstract
+        """
+        ns = {}
+        exec('from pandas_composition.lazy import *', ns)
+        assert 'LazyFrame' in ns
+        for name in ['where', 'log', 'exp', 'sqrt', 'abs']:
+            assert name not in ns
+        self.assertRaises(TypeError, lazy.expr.Node)
+        self.assertRaises(TypeError, lazy.expr.Op)
+
+    def test_program_cache(self):
+        """
+        The same formula shape should compile once
+        """
+        cache = lazy.program_cache
+        cache.clear()
+        other = pd.DataFrame(np.random.randn(100, 5))
+        correct = df * (df2 + 1)
+        test = lf * (lf2 + 1)
+        tm.assert_almost_equal(correct.values, test.values)
+        assert cache.misses == 1
+
+        lo = LazyFrame(other)
+        test = lo * (df2.tail(100) + 1)
+        test.eval(inplace=True)
+        assert cache.misses == 1
+        assert cache.hits == 1
+
+        # different dtypes compile again
+        test = LazyFrame(other.astype('float32')) * (df2.tail(100) + 1)
+        test.eval()
+        assert cache.misses == 2
+
+    def test_aligned_eval(self):
+        """
+        Evaluation should align operands and keep labels
+        """
+        ind = pd.date_range(start="2000", freq="D", periods=100)
+        tdf = pd.DataFrame(np.random.randn(100, 3), index=ind, columns=list('abc'))
+        tdf2 = pd.DataFrame(np.random.randn(90, 4), index=ind[5:95],
+                            columns=list('abcd'))
+
+        # same labels
+        correct = tdf * 2 + tdf
+        test = LazyFrame(tdf) * 2 + tdf
+        tm.assert_frame_equal(correct, test.eval())
+
+        # misaligned
+        correct = tdf * 2 + tdf2
+        test = LazyFrame(tdf) * 2 + LazyFrame(tdf2)
+        tm.assert_frame_equal(correct, test.eval())
+
+        # bool dtype
+        correct = tdf > 0
+        test = (LazyFrame(tdf) > 0).eval()
+        tm.assert_frame_equal(correct, test)
+
+    def test_prepare_no_copy(self):
+        """
+        Aligned operands should be views of the frame data, in whichever
+        orientation the frames are contiguous in
+        """
+        from pandas_composition.lazy import engine
+        # built from a 2-D array, values is C-contiguous
+        arrays, wrap = engine.prepare({'a': df, 'b': df2})
+        assert not wrap.transposed
+        assert arrays['a'].flags.c_contiguous
+        assert np.may_share_memory(arrays['a'], df.values)
+        res = arrays['a'] + arrays['b']
+        out = wrap(res)
+        assert out.index is df.index
+        assert np.may_share_memory(out.values, res)
+
+        # pandas stores frames built from a dict by column
+        cols = pd.DataFrame(dict((i, np.random.randn(10000)) for i in range(5)))
+        cols2 = pd.DataFrame(dict((i, np.random.randn(10000)) for i in range(5)))
+        arrays, wrap = engine.prepare({'a': cols, 'b': cols2})
+        assert wrap.transposed
+        assert arrays['a'].flags.c_contiguous
+        assert np.may_share_memory(arrays['a'], cols.values)
+        res = arrays['a'] + arrays['b']
+        out = wrap(res)
+        assert out.index is cols.index
+        assert np.may_share_memory(out.values, res)
+        tm.assert_frame_equal(out, cols + cols2)
+
+    def test_lazy_series(self):
+        """
+        LazySeries defers like LazyFrame
+        """
+        s = df[0]
+        s2 = df[1]
+        ls = s.lazy()
+        assert isinstance(ls, LazySeries)
+
+        correct = s > s2.shift(1) + 0.1
+        test = ls > LazySeries(s2).shift(1) + 0.1
+        assert isinstance(test, LazySeries)
+        assert test.pobj.empty
+        tm.assert_series_equal(correct, test.eval())
+
+        correct = np.log(np.abs(s)) * 2 - s2
+        test = lazy.log(abs(ls)) * 2 - s2
+        assert isinstance(test, LazySeries)
+        tm.assert_almost_equal(correct.values, test.values)
+
+    def test_mixed_series_frame(self):
+        """
+        Series broadcast across the columns of frames, aligned on the index
+        """
+        s = df[0]
+        correct = df.mul(s, axis=0) + 1
+        test = lf * s.lazy() + 1
+        assert isinstance(test, LazyFrame)
+        tm.assert_frame_equal(correct, test.eval())
+
+        correct = df2.add(s * 2, axis=0)
+        test = s.lazy() * 2 + lf2
+        assert isinstance(test, LazyFrame)
+        tm.assert_frame_equal(correct, test.eval())
+
+        # pandas aligns plain Series on the columns
+        self.assertRaises(ValueError, lambda: lf - df.mean())
+        self.assertRaises(ValueError, lambda: lf * s)
+        self.assertRaises(ValueError, lazy.where, lf > 0, s, 0)
+        correct = df - df.mean()
+        tm.assert_frame_equal(correct, (lf - df.mean().values).eval())
+
+    def test_blocked_eval(self):
+        """
+        Evaluating in row blocks into a preallocated/memmapped out
+        """
+        import os
+        import tempfile
+
+        s = df[0]
+        correct = df.mul(s, axis=0) + df2
+        test = lf * s.lazy() + lf2
+        tm.assert_frame_equal(correct, test.eval(block_size=999, nthreads=1))
+
+        out = np.empty(df.shape)
+        res = test.eval(block_size=1000, out=out)
+        tm.assert_frame_equal(correct, res)
+        assert np.may_share_memory(res.values, out)
+
+        # memmap operand and output
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            mm = np.memmap(path, dtype=df.values.dtype, mode='w+', shape=df.shape)
+            mm[:] = df.values
+            mdf = pd.DataFrame(mm, index=df.index, columns=df.columns)
+            out = np.empty(df.shape, dtype=bool)
+            res = (mdf.lazy() > lf2).eval(block_size=512, out=out)
+            tm.assert_frame_equal(df > df2, res)
+
+            res = (s.lazy() * 2).eval(block_size=512)
+            tm.assert_series_equal(s * 2, res)
+            del mm, mdf
+        finally:
+            os.remove(path)
+
+    def test_defer_shares_structure(self):
+        """
+        Deferred ops reuse their parent's nodes and build no pandas objects
+        """
+        prev = lf
+        for i in range(10000):
+            test = prev + 1
+            assert test._expr.left is prev._node()
+            prev = test
+        assert test.pobj is LazyFrame._empty_pobj
+
+        test = lf
+        for i in range(50):
+            test = test * 1.01 + 1
+        correct = df
+        for i in range(50):
+            correct = correct * 1.01 + 1
+        tm.assert_almost_equal(correct.values, test.values)
+
+    def test_shared_empty_pobj(self):
+        """
+        Writing to an un-evaled object evaluates it instead of changing
+        the empty pobj they all share
+        """
+        ls = lf[0] + 1
+        other = lf[1] * 2
+        ls.name = 'x'
+        assert ls.evaled
+        assert ls.name == 'x'
+        assert LazySeries._empty_pobj.name is None
+        assert other.pobj is LazySeries._empty_pobj
+
+        test = lf + 1
+        test['new'] = 1
+        assert test.evaled
+        assert 'new' in test.columns
+        assert len(LazyFrame._empty_pobj.columns) == 0
+        tm.assert_frame_equal(test.pobj[[0, 1]], df[[0, 1]] + 1)
+
+        test = lf * 2
+        del test[0]
+        assert 0 not in test.columns
+        assert len(LazyFrame._empty_pobj.columns) == 0
+
+    def test_common_subexpressions(self):
+        """
+        Repeated sub-expressions are evaluated once
+        """
+        from pandas_composition.lazy import engine
+        correct = (df - df2) / abs(df - df2)
+        test = (lf - lf2) / abs(lf - lf2)
+        full, ns = engine.plan(test._node())
+        assert '-' not in full
+        assert len(ns) == 1
+        tm.assert_frame_equal(correct, test.eval())
+
+    def test_result_memo(self):
+        """
+        Memoized results are reused by later evals and shared sub-trees
+        """
+        from pandas_composition.lazy import engine
+        memo = lazy.result_cache
+        memo.clear()
+        memo.max_bytes = 10 * df.values.nbytes
+        try:
+            test = lf * 2 + lf2
+            res = test.eval()
+            again = test.eval()
+            assert memo.hits == 1
+            # a copy sharing the data
+            assert again is not res
+            assert np.may_share_memory(again.values, res.values)
+            again['new'] = 1
+            assert 'new' not in test.eval().columns
+
+            # shared sub-tree is passed as an operand
+            bigger = (lf * 2 + lf2) ** 2
+            full, ns = engine.plan(bigger._node(), memo)
+            assert len(ns) == 1
+            assert np.may_share_memory(list(ns.values())[0].values, res.values)
+            tm.assert_frame_equal((df * 2 + df2) ** 2, bigger.eval())
+
+            # sub-trees under a selection are keyed by what was selected
+            memo.clear()
+            inner = (lf * 2 + lf2).iloc[:100]
+            (inner * inner).eval()
+            assert memo.hits == 0
+            res = (inner * inner + 1).eval()
+            assert memo.hits == 1
+            correct = (df * 2 + df2).iloc[:100]
+            tm.assert_frame_equal(correct * correct + 1, res)
+
+            # evicted past max_bytes
+            memo.max_bytes = df.values.nbytes
+            (lf + 1).eval()
+            (lf + 2).eval()
+            assert len(memo) == 1
+            assert memo.nbytes <= memo.max_bytes
+        finally:
+            memo.max_bytes = 0
+            memo.clear()
+
+    def test_selection_pushdown(self):
+        """
+        Row/column selections are deferred and done on the operands
+        """
+        from pandas_composition.lazy import engine
+        ind = pd.date_range(start="2000", freq="D", periods=100)
+        tdf = pd.DataFrame(np.random.randn(100, 3), index=ind, columns=list('abc'))
+        tdf2 = pd.DataFrame(np.random.randn(90, 4), index=ind[5:95],
+                            columns=list('abcd'))
+        correct = tdf * 2 + tdf2
+        test = LazyFrame(tdf) * 2 + LazyFrame(tdf2)
+
+        sel = test[['a', 'b']]
+        assert isinstance(sel, LazyFrame)
+        assert sel.pobj.empty
+        tm.assert_frame_equal(correct[['a', 'b']], sel.eval())
+
+        tm.assert_frame_equal(correct.iloc[-10:], test.iloc[-10:].eval())
+        tm.assert_frame_equal(correct.tail(), test.tail().eval())
+        tm.assert_frame_equal(correct.head(3), test.head(3).eval())
+        tm.assert_frame_equal(correct.iloc[5:20, [0, 2]],
+                              test.iloc[5:20, [0, 2]].eval())
+        tm.assert_frame_equal(correct.loc[ind[10]:ind[20]],
+                              test.loc[ind[10]:ind[20]].eval())
+
+        col = test['a']
+        assert isinstance(col, LazySeries)
+        tm.assert_series_equal(correct['a'], col.eval())
+
+        # only the selected region is computed
+        full, ns = engine.plan(test.tail(10)._node())
+        assert all(len(value) == 10 for value in ns.values())
+
+        # selections combine with further operations
+        tm.assert_frame_equal(correct.tail(10) + 1, (test.tail(10) + 1).eval())
+        tm.assert_series_equal(correct['b'].tail(3),
+                               test['b'].tail(3).eval())
+
+    def test_eval_async(self):
+        """
+        Background evaluation returns futures
+        """
+        correct = df * 2 + df2
+        test = lf * 2 + lf2
+        future = test.eval_async()
+        tm.assert_frame_equal(correct, future.result())
+        assert test.pobj.empty
+
+        try:
+            import asyncio
+        except ImportError:
+            return
+        loop = asyncio.new_event_loop()
+        try:
+            res = loop.run_until_complete(test.eval_awaitable(loop=loop))
+        finally:
+            loop.close()
+        tm.assert_frame_equal(correct, res)
+
+    def test_nthreads_threadsafe(self):
+        """
+        A different thread count waits until the one set is restored
+        """
+        import threading
+        import numexpr as ne
+        from pandas_composition.lazy.cache import NumThreads
+
+        guard = NumThreads()
+        before = ne.get_num_threads()
+        seen = []
+
+        def other():
+            guard.acquire(before + 1)
+            seen.append(ne.get_num_threads())
+            guard.release()
+
+        guard.acquire(1)
+        # same count shares it
+        guard.acquire(1)
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive()
+        assert ne.get_num_threads() == 1
+        guard.release()
+        guard.release()
+        thread.join()
+        assert seen == [before + 1]
+        assert ne.get_num_threads() == before
+
+        correct = df * 2 + df2
+        test = lf * 2 + lf2
+        futures = [test.eval_async(nthreads=n) for n in [1, 2, 1, 2]]
+        for future in futures:
+            tm.assert_frame_equal(correct, future.result())
+        assert ne.get_num_threads() == before
+
+    def test_evaluate_many(self):
+        """
+        Batches are evaluated together with shared alignment
+        """
+        from pandas_composition.lazy import engine
+        tdf = df2.iloc[5:]
+        tests = [lf * 2 + tdf, lf - tdf, (lf - tdf) * (lf + tdf)]
+        corrects = [df * 2 + tdf, df - tdf, (df - tdf) * (df + tdf)]
+        tests.append(lf2)
+        corrects.append(df2)
+        results = lazy.evaluate_many(tests)
+        for correct, res in zip(corrects, results):
+            tm.assert_frame_equal(correct, res)
+
+        aligner = engine.Aligner()
+        index = aligner.union([df.index, tdf.index])
+        assert aligner.union([df.index, tdf.index]) is index
+        aligned = aligner.reindex(tdf, index, df.columns)
+        assert aligner.reindex(tdf, index, df.columns) is aligned
+
+        lazy.evaluate_many(tests[:2], inplace=True)
+        assert tests[0].evaled
+
+    def test_executor_overlap(self):
+        """
+        Pool evaluations run numexpr single threaded and at the same time
+        """
+        import threading
+        from pandas_composition.lazy import engine
+        try:
+            Barrier = threading.Barrier
+        except AttributeError:
+            # python 2
+            return
+
+        lazy.set_executor(max_workers=2)
+        # each waits for the other inside the kernel call
+        barrier = Barrier(2, timeout=10)
+        seen = []
+        evaluate = engine.evaluate
+
+        def wait_evaluate(*args, **kwargs):
+            seen.append(kwargs.get('nthreads'))
+            barrier.wait()
+            return evaluate(*args, **kwargs)
+
+        engine.evaluate = wait_evaluate
+        try:
+            futures = [(lf * 2 + lf2).eval_async(), (lf - lf2).eval_async()]
+            tm.assert_frame_equal(df * 2 + df2, futures[0].result())
+            tm.assert_frame_equal(df - df2, futures[1].result())
+
+            results = lazy.evaluate_many([lf * 3 + lf2, lf / 2 - lf2])
+            tm.assert_frame_equal(df * 3 + df2, results[0])
+            tm.assert_frame_equal(df / 2 - df2, results[1])
+        finally:
+            engine.evaluate = evaluate
+            lazy.set_executor()
+        assert seen == [1, 1, 1, 1]
+
+    def test_reductions(self):
+        """
+        Reductions are fused into the expression and return labeled results
+        """
+        correct = df * 2 + df2
+        test = lf * 2 + lf2
+        for how in ['sum', 'mean', 'min', 'max', 'count']:
+            tm.assert_series_equal(getattr(correct, how)(),
+                                   getattr(test, how)())
+            tm.assert_series_equal(getattr(correct, how)(axis=1),
+                                   getattr(test, how)(axis=1))
+        # a product over 10000 rows would just over/underflow
+        tm.assert_series_equal(correct.prod(axis=1), test.prod(axis=1))
+        assert test.pobj.empty
+
+        # count of true
+        tm.assert_series_equal((df > df2).sum(), (lf > lf2).sum())
+
+        s = df[0]
+        assert np.allclose(s.mean(), (s.lazy() * 1).mean())
+
+        withnan = df.where(df > 0)
+        test = withnan.lazy() + 1
+        tm.assert_series_equal((withnan + 1).min(), test.min())
+        tm.assert_series_equal((withnan + 1).sum(), test.sum())
+        tm.assert_series_equal((withnan + 1).count(), test.count())
+
+        # numexpr min/max skip NaN on their own
+        for how in ['sum', 'mean', 'min', 'max']:
+            tm.assert_series_equal(getattr(withnan + 1, how)(skipna=False),
+                                   getattr(test, how)(skipna=False))
+        test = LazyFrame({'a': [1, np.nan, 3]}) * 1
+        assert np.isnan(test.min(skipna=False)['a'])
+        assert np.isnan(test.max(skipna=False)['a'])
+
+    def test_explain(self):
+        """
+        explain describes the evaluation and the timings of the last eval
+        """
+        tdf = df2.iloc[5:]
+        test = (lf - tdf) * (lf - tdf) + 1
+        ex = test.explain()
+        assert test.pobj.empty
+        assert ex.timings is None
+        nbytes = df.values.nbytes
+        assert ex.output_bytes == nbytes
+        # tdf is reindexed and the shared difference is kept
+        assert ex.align_bytes == nbytes
+        assert ex.shared_bytes == nbytes
+        assert ex.temp_bytes == 2 * nbytes
+        # pandas allocates the difference twice and the product
+        assert ex.eager_bytes == 3 * nbytes
+        info = ex.info(ex.root)
+        assert info.shape == df.shape
+        assert info.dtype == np.float64
+        assert 'shared' in repr(ex)
+        # operands are shown like pandas, same as the tree
+        aligned = [op for op in ex.operands.values() if op.nbytes]
+        assert aligned[0].shape == tdf.shape
+        assert aligned[0].aligned_shape == df.shape
+        assert 'aligned to {0}'.format(df.shape) in repr(ex)
+
+        # selections are pushed down first
+        assert test.tail(3).explain().output_bytes == 3 * 5 * 8
+        # comparisons are bool
+        assert (lf > lf2).explain().output_bytes == df.size
+
+        test.eval()
+        timings = test.explain().timings
+        assert timings.kernel > 0
+        assert timings.total >= timings.align + timings.compile + timings.kernel
+        # not metadata, so boxed results and pickles don't carry it
+        assert '_timings_' not in test._get('__dict__')
+        assert test.tail(3).explain().timings is None
+
+    def test_eval_dtype(self):
+        """
+        eval can cast to a reduced precision dtype
+        """
+        correct = df * 2.5 + df2
+        res = (lf * 2.5 + lf2).eval(dtype='float32')
+        assert (res.dtypes == np.float32).all()
+        tm.assert_frame_equal(correct.astype(np.float32), res,
+                              check_less_precise=True)
+
+        # integers are cast as well
+        idf = pd.DataFrame(np.arange(50).reshape(10, 5))
+        res = (idf.lazy() * 2).eval(dtype=np.float32)
+        tm.assert_frame_equal((idf * 2).astype(np.float32), res)
+
+        # comparisons stay bool. where gives dtype
+        res = (lf > 0.5).eval(dtype='float32')
+        tm.assert_frame_equal(df > 0.5, res)
+        res = lazy.where(lf > 0, lf, np.nan).eval(dtype='float32',
+                                                  block_size=333)
+        tm.assert_frame_equal(df.where(df > 0).astype(np.float32), res)
+        # as do integer literals
+        res = lazy.where(lf > 0, 1, 0).eval(dtype='float32')
+        assert (res.dtypes == np.float32).all()
+        tm.assert_frame_equal((df > 0).astype(np.float32), res)
+
+        self.assertRaises(ValueError, (lf + 1).eval, dtype='int32')
+
+    def test_graph(self):
+        """
+        Graphs reference operands by handle and pickle without the data
+        """
+        import pickle
+        from pandas_composition.lazy import remote
+        tdf = df2.iloc[5:]
+        diff = lf - tdf
+        test = lazy.where(diff > 0, diff * diff, -lf).tail(100)
+        d = df - tdf
+        correct = (d * d).where(d > 0, -df).tail(100)
+
+        stores = [remote.FileStore]
+        try:
+            from multiprocessing import shared_memory
+            stores.append(remote.SharedMemoryStore)
+        except ImportError:
+            pass
+        for klass in stores:
+            with klass() as store:
+                graph = test.to_graph(store)
+                assert len(graph.operands) == 2
+                data = pickle.dumps(graph)
+                assert len(data) < df.values.nbytes // 10
+                res = remote.evaluate(pickle.loads(data))
+                tm.assert_frame_equal(correct, res)
+                # exported once
+                assert (lf + 1).to_graph(store).operands[0] is graph.operands[0]
+                # frames are stored the way they are contiguous
+                assert not graph.operands[0].transposed
+                # arrays still using the blocks keep them mapped
+                tree = remote.load(graph)
+            tm.assert_frame_equal(df, lazy.expr.operands(tree)[0].value)
+            del tree
+            remote._close([])
+            assert remote._unclosed == []
+
+        self.assertRaises(TypeError, remote.Store)
+
 if __name__ == '__main__':
     import nose
     nose.runmodule(argv=[__file__,'-vvs','-x','--pdb', '--pdb-failure'],exit=False)
@@ -3,7 +3,9 @@ import inspect
 
 from pandas.core.generic import NDFrameMeta
 
-from pandas_composition.base import UserPandasObject, _wrap_method
+from pandas_composition.base import (UserPandasObject, _wrap_method,
+                                     ATTR_SPECIAL, ATTR_USER, ATTR_PANDAS,
+                                     SPECIAL_ATTRS, PANDAS_BASES)
 
 class PandasMeta(NDFrameMeta):
     def __new__(cls, name, bases, dct):
@@ -18,7 +20,17 @@ class PandasMeta(NDFrameMeta):
         else: # should be subclass of UserFrame/UserSeries
             pass
 
-        return super(PandasMeta, cls).__new__(cls, name, bases, new_attrs)
+        klass = super(PandasMeta, cls).__new__(cls, name, bases, new_attrs)
+        build_attr_table(klass)
+        return klass
+
+    def __setattr__(cls, name, value):
+        super(PandasMeta, cls).__setattr__(name, value)
+        invalidate_attr_table(cls)
+
+    def __delattr__(cls, name):
+        super(PandasMeta, cls).__delattr__(name)
+        invalidate_attr_table(cls)
 
 class PandasSuperMeta(PandasMeta):
     """
@@ -61,11 +73,35 @@ class PandasSuperMeta(PandasMeta):
         klass = super(PandasSuperMeta, meta).__new__(meta, name, bases, attrs)
         return klass
 
+# per pandas type caches. These only depend on the pandas type so every
+# UserFrame/UserSeries class created for that type shares them.
+_methods_cache = {}
+_init_args_cache = {}
+_pandas_names_cache = {}
+
+def clear_caches():
+    """
+        Clear the per pandas type caches. Only needed if pandas classes are
+        monkey patched with new magic methods after classes were created.
+    """
+    _methods_cache.clear()
+    _init_args_cache.clear()
+    _pandas_names_cache.clear()
+
 def get_methods(pandas_cls):
     """
         Get a combination of PandasObject methods and wrapped DataFrame/Series magic
         methods to use in MetaClass
+
+        The table is computed once per pandas_cls. A copy is returned.
     """
+    methods = _methods_cache.get(pandas_cls)
+    if methods is None:
+        methods = _get_methods(pandas_cls)
+        _methods_cache[pandas_cls] = methods
+    return dict(methods)
+
+def _get_methods(pandas_cls):
     ignore_list = ['__class__', '__metaclass__']
     methods = {}
     user_methods = [(name, meth) for name, meth in UserPandasObject.__dict__.items() \
@@ -88,7 +124,64 @@ def get_methods(pandas_cls):
     return methods
 
 
+def build_attr_table(klass):
+    """
+        Build the name resolution table used by
+        UserPandasObject.__getattribute__.
+
+        Names are resolved in order of precedence:
+            * SPECIAL_ATTRS go straight to the instance
+            * names defined on classes before the pandas classes in the mro
+            * names found on the pandas type, which are wrapped from pobj
+    """
+    table = dict(pandas_names(klass._pandas_type))
+    for kls in klass.__mro__:
+        # stop after pandas-composition class and before pandas classes
+        if kls in PANDAS_BASES:
+            break
+        table.update(dict.fromkeys(kls.__dict__, ATTR_USER))
+    table.update(dict.fromkeys(SPECIAL_ATTRS, ATTR_SPECIAL))
+
+    tr_getattr = None
+    for kls in klass.__mro__:
+        if '__tr_getattr__' in kls.__dict__:
+            tr_getattr = kls.__dict__['__tr_getattr__']
+            break
+    has_tr_getattr = tr_getattr is not UserPandasObject.__dict__['__tr_getattr__']
+
+    # skip PandasMeta.__setattr__ so we don't trigger invalidation
+    type.__setattr__(klass, '_attr_table', table)
+    type.__setattr__(klass, '_has_tr_getattr', has_tr_getattr)
+
+def invalidate_attr_table(klass):
+    """
+        Rebuild the attr table of klass and its subclasses. Called whenever
+        a class is mutated.
+    """
+    if not hasattr(klass, '_pandas_type'):
+        return
+    build_attr_table(klass)
+    for sub in klass.__subclasses__():
+        invalidate_attr_table(sub)
+
+def pandas_names(pandas_type):
+    """
+        {name: ATTR_PANDAS} for every attr of pandas_type. Cached per type.
+    """
+    names = _pandas_names_cache.get(pandas_type)
+    if names is None:
+        names = dict.fromkeys(dir(pandas_type), ATTR_PANDAS)
+        _pandas_names_cache[pandas_type] = names
+    return names
+
+# getargspec is deprecated in python 3
+_getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+
 def init_args(pandas_type):
-    init_func = getattr(pandas_type, '__init__')
-    argspec = inspect.getargspec(init_func)
-    return argspec.args[1:] # skip self
+    args = _init_args_cache.get(pandas_type)
+    if args is None:
+        init_func = getattr(pandas_type, '__init__')
+        argspec = _getargspec(init_func)
+        args = argspec.args[1:] # skip self
+        _init_args_cache[pandas_type] = args
+    return list(args)
@@ -3,12 +3,29 @@ import numpy as np
 from numpy import ndarray
 
 from six import with_metaclass
+from six.moves import copyreg
 
 from pandas_composition.metaclass import PandasMeta
+from pandas_composition.base import (propagate_meta,
+                                     register_ipython_completers,
+                                     maybe_install_ipython_completers,
+                                     PickleBuffer, can_buffer, to_buffer,
+                                     from_buffer)
 
 class UserSeries(with_metaclass(PandasMeta, pd.Series)):
     _pandas_type = pd.Series
-    pobj = None
+    # pobj lives outside of __dict__ so that meta can be shared
+    __slots__ = ('pobj', '_meta_shared')
+    # run __init__ when boxing results. See UserPandasObject._box
+    _box_init = False
+    # metadata propagation. See base.propagate_meta
+    # {attr: META_PROPAGATE | META_DROP | callable}
+    _meta_policy = None
+    # per method overrides. {method_name: {attr: policy}}
+    _meta_method_policy = None
+    # elementwise op engine. None uses the global policy. See compute
+    _engine = None
+    _engine_threshold = None
     def __new__(cls, *args, **kwargs):
         # since i am not calling npndarray.__new__, UserSeries.__array_finalize__ 
         # does not get called.
@@ -18,24 +35,54 @@ class UserSeries(with_metaclass(PandasMeta, pd.Series)):
 
         instance = object.__new__(cls)
         instance.pobj = pobj
+        maybe_install_ipython_completers()
         return instance
 
     # needed to trigger pickle to use UserSeries pickling methods
-    __reduce_ex__ = object.__reduce_ex__
+    def __reduce_ex__(self, protocol):
+        # protocol 5 can send the data out-of-band. see _buffer_state
+        if protocol >= 5 and PickleBuffer is not None:
+            state = self._buffer_state()
+            if state is not None:
+                return copyreg.__newobj__, (type(self),), state
+        return object.__reduce_ex__(self, protocol)
 
     def __getstate__(self):
         """ essentially wrap around pd.Series.__reduce__ and add out meta """
         data = {}
-        meta = self._get('__dict__').copy()
-        pobj = meta.pop('pobj') # remove pobj
-        data['pobj'] = pobj
+        meta = propagate_meta(type(self), self._get('__dict__'), '__getstate__')
+        meta = meta.copy()
+        data['pobj'] = self.pobj
         data['meta'] = meta
         data['version'] = 1
         return data
 
+    def _buffer_state(self):
+        """
+        Version 2 state. The values are a PickleBuffer that protocol 5
+        can send out-of-band. None when they aren't numeric.
+        """
+        pobj = self.pobj
+        if not can_buffer(pobj.dtype):
+            return None
+        data = {}
+        meta = propagate_meta(type(self), self._get('__dict__'), '__getstate__')
+        data['meta'] = meta.copy()
+        data['index'] = pobj.index
+        data['name'] = pobj.name
+        data['dtype'] = pobj.dtype.str
+        data['values'] = to_buffer(pobj.values)
+        data['version'] = 2
+        return data
+
     def __setstate__(self, state):
         """ Call normal pd.Series stuff and update with meta  """
-        self.pobj = state['pobj']
+        if state.get('version') == 2:
+            index = state['index']
+            values = from_buffer(state['values'], state['dtype'], (len(index),))
+            self.pobj = pd.Series(values, index=index, name=state['name'])
+        else:
+            self.pobj = state['pobj']
         self._get('__dict__').update(state['meta'])
 
 # IPYTHON
@@ -53,14 +100,6 @@ def install_ipython_completers():  # pragma: no cover
             dicts.append(getattr(obj, '__completers__'))
         labels = itertools.chain(*dicts)
         return [c for c in labels
-                    if isinstance(c, basestring) and py3compat.isidentifier(c)]                                          
-# Importing IPython brings in about 200 modules, so we want to avoid it unless
-# we're in IPython (when those modules are loaded anyway).
-import sys
-if "IPython" in sys.modules:  # pragma: no cover
-    try: 
-        install_ipython_completers()
-    except Exception:
-        pass 
+                    if isinstance(c, basestring) and py3compat.isidentifier(c)]
 
-us = UserSeries(range(10))
+register_ipython_completers(install_ipython_completers)
@@ -1,5 +1,7 @@
 from unittest import TestCase
 import os.path
+import subprocess
+import sys
 
 import pandas as pd
 import pandas.util.testing as tm
@@ -53,23 +55,42 @@ class TestComposition(TestCase):
         bools = us > 5
         tvals = np.repeat(1, len(us))
         fvals = np.repeat(0, len(us))
-        wh = np.where(bools, tvals, fvals)
+        with composition.patched():
+            wh = np.where(bools, tvals, fvals)
         assert wh.pobj is not None
         assert wh.dtype == int
         tm.assert_series_equal(wh, bools.astype(int))
 
     def test_us_view(self):
         s = pd.Series(range(0, 10), index=range(10, 20))
-        us = s.view(UserSeries)
+        with composition.patched():
+            us = s.view(UserSeries)
         tm.assert_series_equal(s, us)
 
     def test_datetime_us_view(self):
         data = range(0, 10)
         ind = pd.date_range(start="1/1/2000", freq="D", periods=len(data))
         s = pd.Series(data, index=ind)
-        us = s.view(UserSeries)
-        tm.assert_series_equal(s, us)
-        us.view(UserSeries)
+        with composition.patched():
+            us = s.view(UserSeries)
+            tm.assert_series_equal(s, us)
+            us.view(UserSeries)
+
+    def test_patches_opt_in(self):
+        """
+        np.where and pd.Series.view are only replaced on request
+        """
+        orig_where = np.where
+        orig_view = pd.Series.view
+        assert orig_where is composition._np_where
+        composition.install_patches()
+        try:
+            assert np.where is composition.where
+            assert pd.Series.view is composition.view
+        finally:
+            composition.uninstall_patches()
+        assert np.where is orig_where
+        assert pd.Series.view is orig_view
 
     def test_subframe(self):
         """
@@ -166,6 +187,74 @@ class TestComposition(TestCase):
         assert us.loc[11] == 1
         assert us.loc[19] == 9
 
+    def test_attr_table(self):
+        """
+        Test that the per class attr table resolves names and is
+        rebuilt when the class, or a parent class, is mutated.
+        """
+        class SubSeries(UserSeries):
+            pass
+
+        class SubSubSeries(SubSeries):
+            pass
+
+        s = SubSeries(range(10))
+        ss = SubSubSeries(range(10))
+        assert s.sum() == 45
+        assert ss.sum() == 45
+
+        SubSeries.sum = lambda self: 'overridden'
+        assert s.sum() == 'overridden'
+        assert ss.sum() == 'overridden'
+
+        del SubSeries.sum
+        assert s.sum() == 45
+        assert ss.sum() == 45
+
+        # instance meta still resolves
+        s.bob = 'bob'
+        assert s.bob == 'bob'
+
+    def test_method_cache(self):
+        """
+        Method tables are computed once per pandas type and the magic
+        method wrappers are shared between classes.
+        """
+        from pandas_composition import metaclass
+        methods = metaclass.get_methods(pd.Series)
+        assert methods == metaclass.get_methods(pd.Series)
+        assert methods is not metaclass.get_methods(pd.Series)
+
+        class DynSeries(UserSeries):
+            _pandas_type = pd.Series
+
+        assert DynSeries.__dict__['__add__'] is UserSeries.__dict__['__add__']
+        assert DynSeries._init_args == UserSeries._init_args
+        s = DynSeries(range(10))
+        assert type(s + 1) is DynSeries
+
+    def test_import_time(self):
+        """
+        import pandas_composition should add little on top of import pandas
+        """
+        code = ("import time, sys; t = time.time(); import pandas; "
+                "t2 = time.time(); import pandas_composition; "
+                "t3 = time.time(); sys.stdout.write('%f %f %s' % "
+                "(t2 - t, t3 - t2, 'IPython' in sys.modules))")
+        out = subprocess.check_output([sys.executable, '-c', code])
+        pandas_time, overhead, ipython = out.decode().split()
+        # a fraction of the pandas import, so a slow machine doesn't fail it
+        assert float(overhead) < 0.25 * float(pandas_time), out
+        # importing should not pull in IPython
+        assert ipython == 'False', out
+
+    def test_no_import_side_effects(self):
+        """
+        Importing should not construct any objects.
+        """
+        import pandas_composition.series as pseries
+        assert not hasattr(pseries, 'us')
+
 if __name__ == '__main__':
     import nose
     nose.runmodule(argv=[__file__,'-vvs','-x','--pdb', '--pdb-failure'],exit=False)
@@ -54,6 +54,48 @@ class TestUserFrame(TestCase):
         assert df.bob.bob == 'bob'
         assert df.dale.whee == 'whee'
 
+    def test_init_col_meta_lazy(self):
+        """
+        Plain columns should not have col meta captured. Col meta of
+        a UserFrame source is carried over on first access.
+        """
+        df = UserFrame(tm.makeDataFrame())
+        assert len(df._col_classes) == 0
+
+        bob = SubSeries(range(10))
+        bob.bob = 'bob'
+        uf = UserFrame({'bob': bob, 'plain': range(10)})
+        assert list(uf._col_classes) == ['bob']
+
+        test = UserFrame(uf)
+        assert type(test.bob) is SubSeries
+        assert test.bob.bob == 'bob'
+
+        # col meta is copied, not shared with the source
+        test = UserFrame(uf)
+        test._col_meta['bob']['bob'] = 'changed'
+        assert uf._col_meta['bob']['bob'] == 'bob'
+
+        # pending stores stay out of the meta
+        test = UserFrame(uf)
+        assert '_col_pending_' not in test._get('__dict__')
+        assert type(test.tail().bob) is SubSeries
+
+        # chained before the source loaded its own pending stores
+        test = UserFrame(UserFrame(uf))
+        assert type(test.bob) is SubSeries
+        assert test.bob.bob == 'bob'
+
+        # later changes to the source stay out of the copy
+        source = UserFrame(uf)
+        test = UserFrame(source)
+        source._col_meta['bob']['bob'] = 'changed'
+        assert test.bob.bob == 'bob'
+
+        # only columns we have
+        test = UserFrame(uf, columns=['plain'])
+        assert len(test._col_classes) == 0
+
     def test_setitem_col_meta(self):
         """
         Test properly initializing the col meta from a constructor
@@ -201,6 +243,54 @@ class TestUserFrame(TestCase):
             assert isinstance(test.whee2, SubSeries)
             assert test.whee2.frank == 55
 
+    def test_frame_pickle_buffers(self):
+        """
+        Protocol 5 sends numeric data out-of-band and meta in-band
+        """
+        if pickle.HIGHEST_PROTOCOL < 5:
+            return
+        sf = SubFrame(np.random.randn(1000, 10))
+        sf.bob = 'bob'
+        buffers = []
+        data = pickle.dumps(sf, protocol=5, buffer_callback=buffers.append)
+        assert len(buffers) == 1
+        assert len(data) < sf.values.nbytes // 10
+        # the frame is row by row, so that is what gets sent
+        assert np.may_share_memory(np.asarray(buffers[0].raw()), sf.values)
+        test = pickle.loads(data, buffers=buffers)
+        assert isinstance(test, SubFrame)
+        assert test.bob == 'bob'
+        tm.assert_frame_equal(sf.pobj, test.pobj)
+
+        # built from a dict, pandas stores it by column
+        cols = SubFrame(dict((i, np.random.randn(1000)) for i in range(10)))
+        buffers = []
+        data = pickle.dumps(cols, protocol=5, buffer_callback=buffers.append)
+        assert np.may_share_memory(np.asarray(buffers[0].raw()), cols.values)
+        tm.assert_frame_equal(cols.pobj,
+                              pickle.loads(data, buffers=buffers).pobj)
+
+        # mixed dtypes. adjacent columns of a dtype share a buffer
+        s = SubSeries(range(1000))
+        s.frank = 55
+        sf['whee'] = s
+        sf['name'] = 'a'
+        sf.columns = list(range(10)) + [0, 'name']
+        buffers = []
+        data = pickle.dumps(sf, protocol=5, buffer_callback=buffers.append)
+        assert len(buffers) == 2
+        test = pickle.loads(data, buffers=buffers)
+        tm.assert_frame_equal(sf.pobj, test.pobj)
+        assert test.bob == 'bob'
+
+        # in-band without a buffer_callback
+        test = pickle.loads(pickle.dumps(sf, protocol=5))
+        tm.assert_frame_equal(sf.pobj, test.pobj)
+
+        # version 1 for older protocols
+        state = sf.__reduce_ex__(2)[2]
+        assert state['version'] == 1
+
     def test_split_getstate(self):
         """
         Test that __getstate__ splits pandas data from
@@ -291,6 +381,89 @@ class TestUserFrame(TestCase):
         # we have an error here because 'name' is propogated with _get_meta
         df.bs.name = 'hi'
 
+    def test_col_cache(self):
+        """
+        Boxed columns are cached per frame and invalidated on
+        __setitem__, deletion and in-place modification.
+        """
+        class CountFrame(UserFrame):
+            wraps = 0
+            def _wrap_series(self, key, val):
+                CountFrame.wraps += 1
+                return super(CountFrame, self)._wrap_series(key, val)
+
+        s = SubSeries(range(10))
+        s.bob = 'bob'
+        df = CountFrame({'s': s, 'other': range(10)})
+
+        assert type(df.s) is SubSeries
+        wraps = CountFrame.wraps
+        test = df.s
+        test2 = df['s']
+        assert CountFrame.wraps == wraps
+        tm.assert_almost_equal(test, s)
+
+        # meta set on a returned column does not persist
+        test.bob = 'frank'
+        assert df.s.bob == 'bob'
+
+        # neither do changes to the returned column's pobj
+        test = df.s
+        test.name = 'x'
+        test.index = range(100, 110)
+        assert df.s.name == 's'
+        assert df['s'].name == 's'
+        tm.assert_index_equal(df.s.index, df.index)
+        assert CountFrame.wraps == wraps
+
+        # setitem
+        s2 = SubSeries(range(10, 20))
+        s2.bob = 'new'
+        df['s'] = s2
+        assert df.s.bob == 'new'
+        tm.assert_almost_equal(df.s, s2)
+
+        # in-place modification
+        df.pobj['s'] += 1
+        tm.assert_almost_equal(df.s, s2 + 1)
+
+        # derived frames do not share the cache
+        tail = df.tail(3)
+        assert len(tail.s) == 3
+
+        del df['s']
+        assert 's' not in df.columns
+        assert 's' not in df._col_cache
+
+    def test_box_columns(self):
+        """
+        box_columns should box the same as __getitem__
+        """
+        class ASeries(UserSeries):
+            pass
+
+        class AutoBoxFrame(UserFrame):
+            _default_boxer = ASeries
+
+        s = SubSeries(range(10))
+        s.bob = 'bob'
+        df = AutoBoxFrame({'s': s, 'a': range(10), 'b': range(10)})
+
+        items = df.box_columns()
+        assert [k for k, v in items] == list(df.columns)
+        for key, col in items:
+            assert type(col) is type(df[key])
+            tm.assert_almost_equal(col, df[key])
+
+        items = dict(df.box_columns(['s', 'a']))
+        assert len(items) == 2
+        assert items['s'].bob == 'bob'
+        assert isinstance(items['a'], ASeries)
+
+        items = dict(df.iteritems())
+        assert type(items['s']) is SubSeries
+        assert isinstance(items['b'], ASeries)
+
     def test_default_boxer_passthrough(self):
         """
         When an autoboxer Series has an init param,
@@ -314,7 +487,7 @@ class TestUserFrame(TestCase):
 
         s = af["A"]
         # make sure we're not storing the data vai col_meta
-        assert "bob" not in af._col_meta['A']
+        assert "bob" not in af._col_meta.get('A', {})
         # verify that bob is passed to autoboxed series
         assert s.bob == 'hello'
 
@@ -336,6 +509,38 @@ class TestUserFrame(TestCase):
         test = ss + 1 # currently errors
         assert test.bob == 123
 
+    def test_box_skips_init(self):
+        """
+        Boxing a result should attach the pandas object directly without
+        running the constructor, unless the class opts in with _box_init.
+        """
+        class CountFrame(UserFrame):
+            inits = 0
+            def __init__(self, *args, **kwargs):
+                CountFrame.inits += 1
+                self.bob = kwargs.get('bob')
+
+        class InitCountFrame(CountFrame):
+            _box_init = True
+
+        cf = CountFrame(np.random.randn(10, 3), bob=123)
+        assert CountFrame.inits == 1
+        tail = cf.tail()
+        assert type(tail) is CountFrame
+        assert tail.bob == 123
+        assert CountFrame.inits == 1
+
+        res = pd.DataFrame(np.random.randn(5, 3))
+        boxed = cf._box(res)
+        assert boxed.pobj is res
+        assert boxed.bob == 123
+
+        icf = InitCountFrame(np.random.randn(10, 3), bob=456)
+        inits = CountFrame.inits
+        tail = icf.tail()
+        assert CountFrame.inits == inits + 1
+        assert tail.bob == 456
+
     def test_init_args_with_series(self):
         """
         Make sure having a pd.Series as a meta attribute
@@ -376,6 +581,87 @@ class TestUserFrame(TestCase):
         t = s.type_method()
         assert t is SubFrame
 
+    def test_engine_policy(self):
+        """
+        Large elementwise ops are routed through numexpr per policy
+        """
+        from pandas_composition import compute
+        calls = []
+        evaluate_op = compute.evaluate_op
+        def counting(obj, name, other):
+            res = evaluate_op(obj, name, other)
+            calls.append(res is not None)
+            return res
+        compute.evaluate_op = counting
+
+        class AutoFrame(UserFrame):
+            _engine = composition.ENGINE_AUTO
+            _engine_threshold = 1000
+
+        try:
+            df = pd.DataFrame(np.random.randn(1000, 5))
+            df2 = pd.DataFrame(np.random.randn(1000, 5))
+            af = AutoFrame(df)
+            af.bob = 'bob'
+
+            res = af * 2 + df2
+            assert calls == [True, True]
+            assert type(res) is AutoFrame
+            assert res.bob == 'bob'
+            tm.assert_frame_equal(res.pobj, df * 2 + df2)
+            tm.assert_frame_equal((2 - af).pobj, 2 - df)
+            tm.assert_frame_equal((af > df2).pobj, df > df2)
+
+            # numexpr would upcast float32 with a float literal
+            del calls[:]
+            f32 = AutoFrame(df.astype('float32'))
+            res = f32 * 0.5
+            assert calls == [False]
+            assert (res.dtypes == 'float32').all()
+            res = f32 + df2.astype('float32')
+            assert calls == [True]
+            assert (res.dtypes == 'float32').all()
+
+            # small frames use pandas
+            del calls[:]
+            small = AutoFrame(df.iloc[:10])
+            tm.assert_frame_equal((small + 1).pobj, df.iloc[:10] + 1)
+            assert calls == [False]
+
+            # unsupported ops fall back to pandas
+            del calls[:]
+            res = af + pd.Series(1, index=df.columns)
+            assert calls == [False]
+
+            # global policy
+            del calls[:]
+            plain = UserFrame(df)
+            plain + 1
+            composition.set_engine(composition.ENGINE_NUMEXPR)
+            plain + 1
+            assert calls == [False, True]
+
+            # un-evaluated lazy operands only hold an empty placeholder
+            from pandas_composition.lazy import LazyFrame
+            lazy = LazyFrame(df2) * 1
+            res = plain + lazy
+            tm.assert_almost_equal(res, df + df2)
+        finally:
+            compute.evaluate_op = evaluate_op
+            composition.set_engine(composition.ENGINE_PANDAS)
+
+        import json
+        try:
+            with TemporaryDirectory() as td:
+                fn = td + '/calibration.json'
+                threshold = composition.calibrate(sizes=[1000, 10000],
+                                                  repeat=1, path=fn)
+                assert threshold > 0
+                with open(fn) as f:
+                    assert json.load(f) == {'threshold': threshold}
+        finally:
+            compute.options['threshold'] = None
+
 
 if __name__ == '__main__':
     class ASeries(UserSeries):
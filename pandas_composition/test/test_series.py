@@ -58,6 +58,26 @@ class TestSeries(TestCase):
             assert isinstance(test, UserSeries)
             assert test.frank == '123'
 
+    def test_series_pickle_buffers(self):
+        """
+        Protocol 5 sends the values out-of-band
+        """
+        if pickle.HIGHEST_PROTOCOL < 5:
+            return
+        s = UserSeries(np.random.randn(1000), name='bob')
+        s.frank = '123'
+        buffers = []
+        data = pickle.dumps(s, protocol=5, buffer_callback=buffers.append)
+        assert len(buffers) == 1
+        test = pickle.loads(data, buffers=buffers)
+        tm.assert_series_equal(s.pobj, test.pobj)
+        assert isinstance(test, UserSeries)
+        assert test.frank == '123'
+
+        s = UserSeries(['a', 'b'])
+        test = pickle.loads(pickle.dumps(s, protocol=5, buffer_callback=buffers.append))
+        tm.assert_series_equal(s.pobj, test.pobj)
+
     def test_init_args(self):
         """
         Support init params for things like `series + 1`. While metadata propogates,
@@ -104,6 +124,73 @@ class TestSeries(TestCase):
         else:
             assert False, 'copy should fail as it is a constructor arg'
 
+    def test_copy_on_write_meta(self):
+        """
+        Boxed results share metadata with their source until either
+        side writes to it.
+        """
+        s = UserSeries(range(10))
+        s.bob = 'bob'
+        res = s + 1
+        assert res._get('__dict__') is s._get('__dict__')
+        assert res.bob == 'bob'
+
+        # writing to source does not affect result
+        s.bob = 'bye bye'
+        assert res.bob == 'bob'
+        assert res._get('__dict__') is not s._get('__dict__')
+
+        # writing to result does not affect source
+        res2 = s + 1
+        res2.frank = 'frank'
+        assert 'frank' not in s.meta
+        assert res2.bob == 'bye bye'
+
+        del res2.bob
+        assert s.bob == 'bye bye'
+
+    def test_meta_policy(self):
+        """
+        Test that _meta_policy controls which meta is propagated
+        to results and pickles.
+        """
+        class PolicySeries(UserSeries):
+            _meta_policy = {
+                'source': composition.META_DROP,
+                'total': lambda self: self.sum(),
+            }
+            _meta_method_policy = {
+                'shift': {'source': composition.META_PROPAGATE},
+            }
+
+        s = PolicySeries(range(10))
+        s.source = 'source'
+        s.total = 'stale'
+        s.bob = 'bob'
+
+        res = s + 1
+        assert res.bob == 'bob'
+        assert 'source' not in res.meta
+        assert not hasattr(res, 'source')
+        # recomputed lazily on the result
+        assert 'total' not in res._get('__dict__')
+        assert res.total == 55
+        assert s.total == 'stale'
+        # lazy recompute follows further results
+        res2 = (s + 1) * 2
+        assert res2.total == 110
+
+        # per method override
+        shifted = s.shift(1)
+        assert shifted.source == 'source'
+
+        state = s.__getstate__()
+        assert 'source' not in state['meta']
+        assert 'total' not in state['meta']
+        test = pickle.loads(pickle.dumps(s, protocol=2))
+        assert test.bob == 'bob'
+        assert test.total == 45
+
     def test_monkeyed_pandas_object(self):
         """
         A monkey-patched method on base pandas object is callable
@@ -127,9 +214,27 @@ class TestSeries(TestCase):
         bools = us > 5
         tvals = np.repeat(1, len(us))
         fvals = np.repeat(0, len(us))
-        wh = np.where(bools, tvals, fvals)
+        with composition.patched():
+            wh = np.where(bools, tvals, fvals)
 
         assert isinstance(wh, UserSeries)
+        # condition is left alone
+        assert bools.dtype == bool
+
+        # opt-in only
+        wh = np.where(bools, tvals, fvals)
+        assert not isinstance(wh, UserSeries)
+
+    def test_np_where_frame(self):
+        class SubFrame(composition.UserFrame):
+            pass
+        df = SubFrame(np.random.randn(10, 3), columns=list('abc'))
+        df.bob = 'bob'
+        with composition.patched():
+            wh = np.where(df > 0, 1, 0)
+        assert type(wh) is SubFrame
+        assert wh.bob == 'bob'
+        assert list(wh.columns) == list('abc')
 
     def test_series_view(self):
         """